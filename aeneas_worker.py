@@ -0,0 +1,215 @@
+import os
+import sys
+import json
+import queue
+import resource
+import logging
+import threading
+import subprocess
+from pathlib import Path
+from metrics import record_process
+
+class AeneasWorkerUnavailable(Exception):
+    """
+    Raised when a worker process could not be started or died while aligning.
+    """
+
+class AeneasWorker:
+    """
+    A long-lived Python process with aeneas already imported.
+
+    Jobs are sent as JSON lines on the worker's stdin and sync maps come back as JSON lines on its
+    stdout, so an alignment only pays for the alignment itself, not for interpreter start-up and
+    imports, and no sync map file is written.
+
+    Responses are read by a background thread, so a worker that hangs is given up on after `timeout`
+    seconds instead of blocking the job.
+
+    :param timeout: float - Seconds to wait for the worker to start or to finish an alignment; None waits forever.
+    """
+    def __init__(self, timeout=None):
+        self.timeout = timeout
+        self.process = None
+        self._lines = None
+
+    def start(self):
+        self.process = subprocess.Popen(
+            [sys.executable, str(Path(__file__).resolve())],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+            bufsize=1
+        )
+        self._lines = queue.Queue()
+        threading.Thread(target=self._read_lines, args=(self.process.stdout, self._lines), daemon=True).start()
+        # The worker reports once aeneas is imported (or failed to import)
+        self.read_response()
+        logging.debug(f"Aeneas worker started: pid {self.process.pid}")
+
+    @staticmethod
+    def _read_lines(stdout, lines):
+        for line in stdout:
+            lines.put(line)
+        lines.put(None)
+
+    def read_response(self):
+        # Anything but a JSON line in time means the worker is out of sync or stuck; it cannot be reused
+        try:
+            line = self._lines.get(timeout=self.timeout)
+        except queue.Empty:
+            self.close()
+            raise AeneasWorkerUnavailable(f"Aeneas worker did not respond within {self.timeout}s")
+        if line is None:
+            raise AeneasWorkerUnavailable(f"Aeneas worker exited with status {self.process.poll()}")
+        try:
+            response = json.loads(line)
+        except ValueError:
+            raise AeneasWorkerUnavailable(f"Aeneas worker sent an invalid response: {line.strip()[:200]!r}")
+        if response.get("fatal"):
+            raise AeneasWorkerUnavailable(response["fatal"])
+        return response
+
+    def align(self, audio_path, text_path, configuration):
+        """
+        Align an audio file with its transcript.
+
+        :param audio_path: Path - The audio file.
+        :param text_path: Path - The plain text transcript.
+        :param configuration: str - The aeneas task configuration string.
+        :return: dict - The sync map, in the same structure aeneas writes as JSON.
+        """
+        request = {
+            "audio": str(Path(audio_path).resolve()),
+            "text": str(Path(text_path).resolve()),
+            "configuration": configuration
+        }
+        try:
+            self.process.stdin.write(json.dumps(request) + "\n")
+            self.process.stdin.flush()
+        except (BrokenPipeError, OSError) as e:
+            raise AeneasWorkerUnavailable(f"Aeneas worker is not accepting jobs: {e}")
+        response = self.read_response()
+        # The worker is not a child of this job, so report the CPU time it spent on the job instead
+        record_process(response.get("cpu_seconds", 0.0), spawned=False)
+        if "error" in response:
+            raise Exception(f"Aeneas alignment failed for {audio_path}: {response['error']}")
+        return response["sync_map"]
+
+    def close(self):
+        if self.process is None:
+            return
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout=5)
+        except (OSError, subprocess.TimeoutExpired):
+            self.process.kill()
+        self.process = None
+
+class AeneasWorkerPool:
+    """
+    A pool of up to `size` aeneas workers, started on demand and reused across jobs.
+
+    A worker that dies, hangs or breaks the protocol is discarded and replaced by a fresh one on the next
+    request; the failing call raises AeneasWorkerUnavailable so the caller can fall back to another
+    alignment path. The same happens when every worker stays busy for `timeout` seconds.
+
+    :param size: int - Maximum number of workers.
+    :param timeout: float - Seconds a worker may take to start or to align one pair, and a caller may wait
+                            for a free worker.
+    """
+    def __init__(self, size=2, timeout=None):
+        self.size = size
+        self.timeout = timeout
+        self._idle = []
+        self._started = 0
+        # Signalled whenever a worker is returned or discarded, so waiting callers recheck for a free
+        # worker or room to start one
+        self._available = threading.Condition()
+
+    def _acquire(self):
+        with self._available:
+            if not self._available.wait_for(lambda: self._idle or self._started < self.size, self.timeout):
+                raise AeneasWorkerUnavailable(f"No aeneas worker became free within {self.timeout}s")
+            if self._idle:
+                return self._idle.pop()
+            self._started += 1
+        worker = AeneasWorker(self.timeout)
+        try:
+            worker.start()
+        except Exception:
+            self._discard(worker)
+            raise
+        return worker
+
+    def _release(self, worker):
+        with self._available:
+            self._idle.append(worker)
+            self._available.notify()
+
+    def _discard(self, worker):
+        worker.close()
+        with self._available:
+            self._started -= 1
+            self._available.notify()
+
+    def align(self, audio_path, text_path, configuration):
+        worker = self._acquire()
+        try:
+            sync_map = worker.align(audio_path, text_path, configuration)
+        except AeneasWorkerUnavailable:
+            self._discard(worker)
+            raise
+        except Exception:
+            self._release(worker)  # The job failed, not the worker
+            raise
+        self._release(worker)
+        return sync_map
+
+    def warm_up(self):
+        """
+        Start every worker up front so the first jobs do not pay for the aeneas import.
+        """
+        workers = []
+        try:
+            for _ in range(self.size):
+                workers.append(self._acquire())
+        except AeneasWorkerUnavailable as e:
+            logging.warning(f"Could not start aeneas worker: {e}")
+        for worker in workers:
+            self._release(worker)
+
+def serve():
+    # Keep the real stdout for the protocol and send anything else printed to stderr
+    protocol = os.fdopen(os.dup(1), "w", buffering=1)
+    os.dup2(2, 1)
+    sys.stdout = sys.stderr
+
+    def send(message):
+        protocol.write(json.dumps(message) + "\n")
+
+    try:
+        from aeneas.executetask import ExecuteTask
+        from aeneas.task import Task
+    except Exception as e:
+        send({"fatal": f"Could not import aeneas: {e}"})
+        return
+    send({"ready": True})
+
+    def cpu_seconds():
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        return usage.ru_utime + usage.ru_stime
+
+    for line in sys.stdin:
+        request = json.loads(line)
+        started = cpu_seconds()
+        try:
+            task = Task(config_string=request["configuration"])
+            task.audio_file_path_absolute = request["audio"]
+            task.text_file_path_absolute = request["text"]
+            ExecuteTask(task).execute()
+            send({"sync_map": json.loads(task.sync_map.json_string), "cpu_seconds": cpu_seconds() - started})
+        except Exception as e:
+            send({"error": f"{type(e).__name__}: {e}", "cpu_seconds": cpu_seconds() - started})
+
+if __name__ == "__main__":
+    serve()
@@ -1,13 +1,37 @@
+import os
+import re
+import logging
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from pydub import AudioSegment
+from metrics import propagate, run_process
+from http_retry import RETRY_STATUS_CODES, pooled_session, retry_after_seconds, wait_before_retry
+
+ELEVENLABS_API_URL = "https://api.elevenlabs.io"
 
 class AudioGenerator:
-    def __init__(self, api_key: str, speed: float = 1.15, set_speed_up: bool = True):
+    def __init__(self, api_key: str, speed: float = 1.15, set_speed_up: bool = True, cache=None, api_url: str = ELEVENLABS_API_URL,
+                 chunked: bool = False, max_workers: int = 4, max_chunk_chars: int = 1000, max_retries: int = 5,
+                 session: requests.Session = None):
         self.api_key = api_key
         self.speed = speed
         self.set_speed_up = set_speed_up
         self.chunk_size = 1024
+        self.cache = cache  # Optional CacheBackend for generated audio
+        self.api_url = api_url.rstrip("/")
+        self.model_id = "eleven_monolingual_v1"
+        self.voice_settings = {
+            "stability": 0.5,
+            "similarity_boost": 0.75
+        }
+        self.chunked = chunked  # Synthesize the text in sentence chunks instead of one request
+        self.max_workers = max_workers
+        self.max_chunk_chars = max_chunk_chars
+        self.max_retries = max_retries
+
+        # Pooled connections; pass a session shared by all requests so connections outlive a single job
+        self.session = session if session is not None else pooled_session(max_workers)
 
     def read_text_file(self, file_path: Path) -> str:
         if not file_path.is_file():
@@ -27,10 +51,65 @@ class AudioGenerator:
         sped_up_audio = audio.speedup(playback_speed=self.speed)
         sped_up_audio.export(file_path, format="mp3")
 
-    def generate_audio(self, text_path: Path, output_path: Path, voice_id: str):
-        text = self.read_text_file(text_path)
-        
-        url = f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}"
+    def split_text(self, text: str) -> list:
+        """
+        Split text into chunks on paragraph and sentence boundaries.
+
+        Sentences are packed into chunks of up to `max_chunk_chars` characters. Chunks never span two
+        paragraphs, so editing one paragraph leaves the chunks of the others unchanged.
+
+        :param text: str - The text to split.
+        :return: list of str - The chunks, in order.
+        """
+        chunks = []
+        for paragraph in re.split(r'\n\s*\n', text):
+            current = ""
+            for sentence in re.split(r'(?<=[.!?])\s+', paragraph.strip()):
+                if not sentence:
+                    continue
+                if current and len(current) + 1 + len(sentence) > self.max_chunk_chars:
+                    chunks.append(current)
+                    current = sentence
+                else:
+                    current = f"{current} {sentence}" if current else sentence
+            if current:
+                chunks.append(current)
+        return chunks
+
+    def cache_key(self, text: str, voice_id: str, speed: float = None, chunking: int = None) -> str:
+        # speed is None for the audio as returned by the API, chunking is None for single request audio
+        return self.cache.make_key("tts", text, voice_id, self.model_id, self.voice_settings, speed, chunking)
+
+    def post_with_backoff(self, url: str, **kwargs) -> requests.Response:
+        """
+        POST to the API, retrying rate limited and failed requests with exponential backoff.
+
+        A Retry-After header from the API takes precedence over the computed delay.
+
+        :param url: str - The URL to post to.
+        :return: requests.Response - The successful response.
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self.session.post(url, **kwargs)
+            except requests.exceptions.RequestException as e:
+                if attempt == self.max_retries:
+                    raise
+                logging.warning(f"Request to {url} failed: {e}")
+                delay = None
+            else:
+                if response.status_code == 200:
+                    return response
+                if response.status_code not in RETRY_STATUS_CODES or attempt == self.max_retries:
+                    raise Exception(f"API request failed with status code {response.status_code}: {response.text}")
+                delay = retry_after_seconds(response)
+                logging.warning(f"API request returned status code {response.status_code}")
+                response.close()
+
+            wait_before_retry(attempt, self.max_retries, delay)
+
+    def request_audio(self, text: str, output_path: Path, voice_id: str):
+        url = f"{self.api_url}/v1/text-to-speech/{voice_id}"
         headers = {
             "Accept": "audio/mpeg",
             "Content-Type": "application/json",
@@ -38,25 +117,100 @@ class AudioGenerator:
         }
         data = {
             "text": text,
-            "model_id": "eleven_monolingual_v1",
-            "voice_settings": {
-                "stability": 0.5,
-                "similarity_boost": 0.75
-            }
+            "model_id": self.model_id,
+            "voice_settings": self.voice_settings
         }
         
-        response = requests.post(url, json=data, headers=headers)
-        
-        if response.status_code != 200:
-            raise Exception(f"API request failed with status code {response.status_code}: {response.text}")
+        response = self.post_with_backoff(url, json=data, headers=headers, stream=True)
         
-        with open(output_path, 'wb') as f:
+        with response, open(output_path, 'wb') as f:
             for chunk in response.iter_content(chunk_size=self.chunk_size):
                 if chunk:
                     f.write(chunk)
         
         print(f"Audio file saved to {output_path}")
 
+    def synthesize_chunk(self, text: str, output_path: Path, voice_id: str) -> Path:
+        # Chunks are cached like any other text, so unchanged paragraphs are never synthesized twice
+        if self.cache is not None and self.cache.fetch(self.cache_key(text, voice_id), output_path):
+            return output_path
+        self.request_audio(text, output_path, voice_id)
+        if self.cache is not None:
+            self.cache.store(self.cache_key(text, voice_id), output_path)
+        return output_path
+
+    def generate_chunked_audio(self, text: str, output_path: Path, voice_id: str):
+        """
+        Synthesize the text chunk by chunk, with up to `max_workers` concurrent requests.
+
+        The chunks are joined by remuxing them with ffmpeg, without re-encoding. Joining the files byte by
+        byte would leave each response's ID3 tag and Xing/LAME header frame in the middle of the stream, and
+        the first chunk's frame count would misstate the duration of the whole file.
+
+        :param text: str - The text to synthesize.
+        :param output_path: Path - Path to the stitched MP3 file.
+        :param voice_id: str - The ElevenLabs voice.
+        """
+        output_path = Path(output_path)
+        chunks = self.split_text(text)
+        if not chunks:
+            raise Exception("The text file does not contain any text to synthesize.")
+        logging.debug(f"Synthesizing {len(chunks)} chunks with {self.max_workers} workers")
+
+        chunk_paths = [output_path.with_name(f"{output_path.stem}.chunk{i}.mp3") for i in range(len(chunks))]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [
+                executor.submit(propagate(self.synthesize_chunk), chunk, chunk_path, voice_id)
+                for chunk, chunk_path in zip(chunks, chunk_paths)
+            ]
+            for future in futures:
+                future.result()
+
+        list_path = output_path.with_name(f"{output_path.stem}.chunks.txt")
+        with open(list_path, 'w') as f:
+            for chunk_path in chunk_paths:
+                f.write(f"file '{os.path.abspath(chunk_path)}'\n")
+        try:
+            run_process([
+                "ffmpeg", "-y", "-v", "error",
+                "-f", "concat", "-safe", "0",
+                "-i", str(list_path),
+                "-map_metadata", "-1",  # No ID3 tag carried over from the first chunk
+                "-c", "copy",
+                str(output_path)
+            ], check=True)
+        finally:
+            list_path.unlink()
+            for chunk_path in chunk_paths:
+                chunk_path.unlink(missing_ok=True)
+
+        print(f"Audio file saved to {output_path}")
+
+    def generate_audio(self, text_path: Path, output_path: Path, voice_id: str):
+        text = self.read_text_file(text_path)
+        speed_up = self.set_speed_up and self.speed != 1
+        chunking = self.max_chunk_chars if self.chunked else None
+
+        # Reuse the final audio if this exact text, voice and settings were rendered before
+        if self.cache is not None:
+            final_key = self.cache_key(text, voice_id, self.speed if speed_up else None, chunking)
+            if self.cache.fetch(final_key, output_path):
+                print(f"Audio file restored from cache to {output_path}")
+                return
+
+        if self.chunked:
+            self.generate_chunked_audio(text, output_path, voice_id)
+        # The API response is cached separately so a new speed does not need another API call
+        elif speed_up and self.cache is not None and self.cache.fetch(self.cache_key(text, voice_id), output_path):
+            print(f"Audio file restored from cache to {output_path}")
+        else:
+            self.request_audio(text, output_path, voice_id)
+            if self.cache is not None:
+                self.cache.store(self.cache_key(text, voice_id), output_path)
+
         if self.set_speed_up:
             self.speed_up_audio_file(output_path)
             print(f"Audio file sped up and saved to {output_path}")
+
+        if self.cache is not None and (speed_up or self.chunked):
+            self.cache.store(final_key, output_path)
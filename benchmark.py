@@ -0,0 +1,361 @@
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import zipfile
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import email
+import email.policy
+from pathlib import Path
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import numpy as np
+from pydub import AudioSegment
+from silence_remover import SilenceRemover
+from video_processor import VideoProcessor
+from metrics import JobMetrics
+from timeline import Timeline
+from encoding import ENCODING_PROFILES, DEFAULT_ENCODING_PROFILE, get_encoding_profile
+
+# Speaking rate of the stubbed text-to-speech service
+CHARACTERS_PER_SECOND = 15
+
+WORDS = ("the", "video", "narration", "scene", "quickly", "moves", "across", "bright", "river", "while",
+         "music", "plays", "softly", "under", "every", "frame", "and", "story", "slowly", "unfolds")
+
+def synthetic_narration(minutes, frame_rate=44100, seed=0):
+    """
+    Generate a narration-like signal: bursts of noise shaped like phrases, separated by pauses.
+
+    :param minutes: float - Length of the narration.
+    :param frame_rate: int - Sample rate.
+    :param seed: int - Random seed, so runs are reproducible.
+    :return: AudioSegment - 16-bit mono audio.
+    """
+    rng = np.random.default_rng(seed)
+    total_frames = int(minutes * 60 * frame_rate)
+    envelope = np.zeros(total_frames, dtype=np.float32)
+    position = 0
+    while position < total_frames:
+        phrase = int(rng.uniform(0.8, 4.0) * frame_rate)
+        envelope[position:position + phrase] = rng.uniform(2000, 8000)
+        position += phrase
+        # Mostly short breaths, sometimes pauses long enough to be trimmed
+        position += int(rng.choice([rng.uniform(0.05, 0.3), rng.uniform(0.6, 2.0)]) * frame_rate)
+    samples = rng.standard_normal(total_frames).astype(np.float32) * envelope
+    samples = samples.clip(-32768, 32767).astype(np.int16)
+    return AudioSegment(samples.tobytes(), frame_rate=frame_rate, sample_width=2, channels=1)
+
+def synthetic_sentences(count, seed=0):
+    """
+    Generate `count` random sentences of 4 to 14 words.
+    """
+    rng = np.random.default_rng(seed)
+    sentences = []
+    for _ in range(count):
+        words = rng.choice(WORDS, size=int(rng.integers(4, 15)))
+        sentences.append(" ".join(words).capitalize() + ".")
+    return sentences
+
+def synthetic_fragments(count, total_seconds, seed=0):
+    """
+    Split `total_seconds` into `count` consecutive fragments of random length.
+
+    :return: list of tuples - (start, end) in seconds.
+    """
+    rng = np.random.default_rng(seed)
+    bounds = np.concatenate(([0.0], np.cumsum(rng.uniform(0.5, 1.5, count))))
+    bounds *= total_seconds / bounds[-1]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+def write_timeline(srt_path, fragments, sentences):
+    """
+    Write the fragments as an SRT, with the alignment JSON next to it like RunAeneas does.
+    """
+    starts, ends = zip(*fragments)
+    timeline = Timeline(starts, ends, sentences)
+    timeline.write_json(srt_path.with_suffix(".json"))
+    return timeline.write_srt(srt_path)
+
+def synthetic_video(path, seconds, width=1280, height=720, fps=30):
+    """
+    Encode a test pattern video with a tone soundtrack using the local ffmpeg.
+    """
+    subprocess.run([
+        "ffmpeg", "-y", "-loglevel", "error",
+        "-f", "lavfi", "-i", f"testsrc2=size={width}x{height}:rate={fps}:duration={seconds}",
+        "-f", "lavfi", "-i", f"sine=frequency=220:sample_rate=44100:duration={seconds}",
+        "-c:v", "libx264", "-preset", "veryfast", "-pix_fmt", "yuv420p", "-c:a", "aac", "-shortest", str(path)
+    ], check=True)
+    return path
+
+def synthetic_music(path, seconds, frequency):
+    subprocess.run([
+        "ffmpeg", "-y", "-loglevel", "error",
+        "-f", "lavfi", "-i", f"sine=frequency={frequency}:sample_rate=44100:duration={seconds}",
+        "-c:a", "libmp3lame", "-b:a", "128k", str(path)
+    ], check=True)
+    return path
+
+class StubTextToSpeech(BaseHTTPRequestHandler):
+    """
+    Stands in for the ElevenLabs API: answers every text-to-speech request with a synthetic narration
+    whose length follows the length of the text.
+    """
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        minutes = max(len(payload["text"]) / CHARACTERS_PER_SECOND, 1) / 60
+        audio = io.BytesIO()
+        synthetic_narration(minutes, seed=len(payload["text"])).export(audio, format="mp3")
+        self.send_response(200)
+        self.send_header("Content-Type", "audio/mpeg")
+        self.send_header("Content-Length", str(audio.getbuffer().nbytes))
+        self.end_headers()
+        self.wfile.write(audio.getvalue())
+
+    def log_message(self, format, *args):
+        pass
+
+class StubSubtitleService(BaseHTTPRequestHandler):
+    """
+    Stands in for the subtitle service: sends the uploaded video back unchanged, so only the transfer is measured.
+    """
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        message = email.message_from_bytes(
+            f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + body, policy=email.policy.HTTP
+        )
+        video = next(part.get_payload(decode=True) for part in message.iter_parts() if part.get_param("name", header="content-disposition") == "video")
+        self.send_response(200)
+        self.send_header("Content-Type", "video/mp4")
+        self.send_header("Content-Length", str(len(video)))
+        self.end_headers()
+        self.wfile.write(video)
+
+    def log_message(self, format, *args):
+        pass
+
+@contextmanager
+def stub_server(handler):
+    """
+    Serve `handler` on a free local port for the duration of the block.
+
+    :return: str - The server's base URL.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def stage_seconds(manifest):
+    return {record["stage"]: record["wall_seconds"] for record in manifest["stages"]}
+
+def time_call(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+def benchmark_silence(args):
+    """
+    Compare the pydub and NumPy silence engines on the same narration.
+    """
+    if args.input:
+        audio = AudioSegment.from_file(args.input)
+    else:
+        audio = synthetic_narration(args.minutes)
+    print(f"Narration: {len(audio) / 60000:.1f} minutes, {audio.frame_rate} Hz, {audio.channels} channel(s)", file=sys.stderr)
+
+    results = {}
+    outputs = {}
+    for engine in args.engines:
+        remover = SilenceRemover(engine=engine)
+        seconds, trimmed = time_call(lambda: remover.trim_segment(audio), args.repeat)
+        outputs[engine] = trimmed.raw_data
+        results[engine] = {"seconds": seconds, "trimmed_ms": len(trimmed)}
+        print(f"{engine}: {seconds:.3f}s", file=sys.stderr)
+
+    if "pydub" in results and "numpy" in results:
+        results["speedup"] = results["pydub"]["seconds"] / results["numpy"]["seconds"]
+        results["identical_output"] = outputs["pydub"] == outputs["numpy"]
+    return {"audio_ms": len(audio), "repeat": args.repeat, "engines": results}
+
+def benchmark_render(args):
+    """
+    Time VideoProcessor on synthetic videos and SRTs, for every combination of length, fragment count
+    and render engine.
+
+    The new timestamps stretch a share of the fragments past the slow-down threshold, so both the
+    copied and the retimed code paths are exercised.
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as temp_dir, stub_server(StubSubtitleService) as subtitle_url:
+        temp_dir = Path(temp_dir)
+        happy_path = synthetic_music(temp_dir / "happy.mp3", 60, 440)
+        sad_path = synthetic_music(temp_dir / "sad.mp3", 60, 330)
+        for seconds in args.seconds:
+            video_path = synthetic_video(temp_dir / f"video_{seconds}.mp4", seconds, *args.size)
+            for fragment_count in args.fragments:
+                rng = np.random.default_rng(fragment_count)
+                sentences = synthetic_sentences(fragment_count, seed=fragment_count)
+                old_fragments = synthetic_fragments(fragment_count, seconds, seed=fragment_count)
+                # Shift every fragment's length by -0.5s to +1.5s in the narration
+                stretch = rng.uniform(-0.5, 1.5, fragment_count)
+                new_lengths = np.maximum([end - start + extra for (start, end), extra in zip(old_fragments, stretch)], 0.2)
+                new_bounds = np.concatenate(([0.0], np.cumsum(new_lengths)))
+                new_fragments = list(zip(new_bounds[:-1], new_bounds[1:]))
+
+                case_dir = temp_dir / f"{seconds}s_{fragment_count}"
+                case_dir.mkdir()
+                srt_old = write_timeline(case_dir / "old.srt", old_fragments, sentences)
+                srt_new = write_timeline(case_dir / "new.srt", new_fragments, sentences)
+                narration_path = case_dir / "narration.wav"
+                synthetic_narration(new_bounds[-1] / 60, seed=fragment_count).export(narration_path, format="wav")
+
+                for engine in args.engines:
+                    output_dir = case_dir / engine
+                    video_processor = VideoProcessor(
+                        narration_path, srt_new, srt_old, video_path, happy_path, sad_path,
+                        happy_start=0, happy_end=int(new_bounds[-1] / 2), sad_start=int(new_bounds[-1] / 2), sad_end=int(new_bounds[-1]) + 1,
+                        bg_width=650, bg_height=120, font_size=35, bottom_padding=50, max_width=500,
+                        output_dir=output_dir, max_workers=args.workers, threads_per_clip=args.threads_per_clip,
+                        render_engine=engine, subtitle_service_url=subtitle_url, subtitle_mode=args.subtitle_mode,
+                        stream_copy=not args.no_stream_copy, encoding_profile=get_encoding_profile(args.profile)
+                    )
+                    job_metrics = JobMetrics(f"render-{seconds}s-{fragment_count}-{engine}")
+                    with job_metrics.activate():
+                        video_processor.process_video()
+                    manifest = job_metrics.manifest()
+                    results.append({
+                        "video_seconds": seconds,
+                        "fragments": fragment_count,
+                        "engine": engine,
+                        "seconds": manifest["total_seconds"],
+                        "stages": manifest["stages"],
+                    })
+                    print(f"{seconds}s, {fragment_count} fragments, {engine}: {manifest['total_seconds']:.3f}s", file=sys.stderr)
+                    shutil.rmtree(output_dir, ignore_errors=True)
+    return {"size": args.size, "subtitle_mode": args.subtitle_mode, "profile": args.profile, "cases": results}
+
+def benchmark_upload(args):
+    """
+    Time the full /upload request against stubbed text-to-speech and subtitle services.
+
+    Aeneas has to be installed. The media caches live in a temporary directory, so the first run of
+    every case is cold and later repeats show the effect of the caches.
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as temp_dir, \
+            stub_server(StubTextToSpeech) as tts_url, stub_server(StubSubtitleService) as subtitle_url:
+        temp_dir = Path(temp_dir)
+        # The app reads its configuration at import time
+        os.environ.update({
+            "ELEVENLABS_API_URL": tts_url,
+            "SUBTITLE_SERVICE_URL": subtitle_url,
+            "MEDIA_CACHE_DIR": str(temp_dir / "cache"),
+            "JOBS_DIR": str(temp_dir / "jobs"),
+            "BGM_HAPPY_PATH": str(synthetic_music(temp_dir / "happy.mp3", 60, 440)),
+            "BGM_SAD_PATH": str(synthetic_music(temp_dir / "sad.mp3", 60, 330)),
+        })
+        from main import app
+        client = app.test_client()
+
+        for seconds in args.seconds:
+            video_path = synthetic_video(temp_dir / f"video_{seconds}.mp4", seconds, *args.size)
+            for sentence_count in args.sentences:
+                script = "\n".join(synthetic_sentences(sentence_count, seed=sentence_count))
+                for run in range(args.repeat):
+                    with open(video_path, "rb") as video:
+                        form = {
+                            "voice_id": "benchmark",
+                            "api_key": "benchmark",
+                            "speed": "1.15",
+                            "set_speed_up": "on",
+                            "happy_start": "0",
+                            "happy_end": str(seconds // 2),
+                            "sad_start": str(seconds // 2),
+                            "sad_end": str(seconds),
+                            "render_engine": args.engine,
+                            "subtitle_mode": args.subtitle_mode,
+                            "encoding_profile": args.profile,
+                            "text": (io.BytesIO(script.encode()), "script.txt"),
+                            "video": (video, "video.mp4"),
+                        }
+                        start = time.perf_counter()
+                        response = client.post("/upload", data=form, content_type="multipart/form-data")
+                        body = response.get_data()
+                        elapsed = time.perf_counter() - start
+
+                    case = {"video_seconds": seconds, "sentences": sentence_count, "run": run, "seconds": elapsed,
+                            "status": response.status_code}
+                    if response.status_code == 200:
+                        with zipfile.ZipFile(io.BytesIO(body)) as archive:
+                            case["stages"] = stage_seconds(json.loads(archive.read("timings.json")))
+                    else:
+                        case["error"] = response.get_json().get("error")
+                    results.append(case)
+                    print(f"{seconds}s, {sentence_count} sentences, run {run}: {elapsed:.3f}s ({response.status_code})", file=sys.stderr)
+    return {"size": args.size, "engine": args.engine, "subtitle_mode": args.subtitle_mode, "profile": args.profile, "cases": results}
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for the video processing pipeline.")
+    parser.add_argument("--output", help="Write the results as JSON to this file (default: stdout)")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    silence = subparsers.add_parser("silence", help="Silence trimming engines")
+    silence.add_argument("--minutes", type=float, default=12, help="Length of the synthetic narration")
+    silence.add_argument("--input", help="Benchmark this audio file instead of a synthetic narration")
+    silence.add_argument("--engines", nargs="+", default=list(SilenceRemover.ENGINES), choices=SilenceRemover.ENGINES)
+    silence.add_argument("--repeat", type=int, default=1, help="Runs per engine; the fastest is reported")
+    silence.set_defaults(run=benchmark_silence)
+
+    render = subparsers.add_parser("render", help="Video rendering on synthetic videos and SRTs")
+    render.add_argument("--seconds", type=int, nargs="+", default=[30, 120], help="Lengths of the synthetic videos")
+    render.add_argument("--fragments", type=int, nargs="+", default=[10, 40], help="Fragment counts of the synthetic SRTs")
+    render.add_argument("--engines", nargs="+", default=list(VideoProcessor.RENDER_ENGINES), choices=VideoProcessor.RENDER_ENGINES)
+    render.add_argument("--size", type=int, nargs=2, default=[1280, 720], metavar=("WIDTH", "HEIGHT"))
+    render.add_argument("--workers", type=int, help="Clip rendering workers (default: from the CPU count)")
+    render.add_argument("--threads-per-clip", type=int, default=2)
+    render.add_argument("--subtitle-mode", default="remote", choices=VideoProcessor.SUBTITLE_MODES)
+    render.add_argument("--no-stream-copy", action="store_true", help="Encode every clip, even those on keyframes")
+    render.add_argument("--profile", default=DEFAULT_ENCODING_PROFILE, choices=ENCODING_PROFILES)
+    render.set_defaults(run=benchmark_render)
+
+    upload = subparsers.add_parser("upload", help="The full /upload request with stubbed external services")
+    upload.add_argument("--seconds", type=int, nargs="+", default=[60], help="Lengths of the synthetic videos")
+    upload.add_argument("--sentences", type=int, nargs="+", default=[10, 30], help="Sentence counts of the synthetic scripts")
+    upload.add_argument("--engine", default="clips", choices=VideoProcessor.RENDER_ENGINES)
+    upload.add_argument("--subtitle-mode", default="remote", choices=VideoProcessor.SUBTITLE_MODES)
+    upload.add_argument("--size", type=int, nargs=2, default=[1280, 720], metavar=("WIDTH", "HEIGHT"))
+    upload.add_argument("--profile", default=DEFAULT_ENCODING_PROFILE, choices=ENCODING_PROFILES)
+    upload.add_argument("--repeat", type=int, default=2, help="Runs per case; the caches are warm after the first")
+    upload.set_defaults(run=benchmark_upload)
+
+    args = parser.parse_args()
+    report = {
+        "benchmark": args.benchmark,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "results": args.run(args),
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
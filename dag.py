@@ -0,0 +1,180 @@
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from metrics import propagate, stage as timed_stage
+
+class Stage:
+    """
+    One step of a pipeline: a function from named input artifacts to named output artifacts.
+
+    :param name: str - Stage name, unique within the graph.
+    :param function: callable - Called with the inputs as keyword arguments. Returns the value of the
+                                single output, or a dict of outputs if the stage declares several.
+    :param inputs: tuple of str - Artifacts the stage needs before it can start.
+    :param outputs: tuple of str - Artifacts the stage produces.
+    :param kind: str - What the stage waits on ("network", "cpu" or "subprocess"); each kind runs on its
+                       own workers, so stages of different kinds never queue behind each other.
+    """
+    KINDS = ("network", "cpu", "subprocess")
+
+    def __init__(self, name, function, inputs=(), outputs=(), kind="subprocess"):
+        if kind not in self.KINDS:
+            raise ValueError(f"Unknown stage kind: {kind}. Expected one of {', '.join(self.KINDS)}")
+        self.name = name
+        self.function = function
+        self.inputs = tuple(inputs)
+        self.outputs = tuple(outputs)
+        self.kind = kind
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def seconds(self):
+        return (self.finished_at or 0) - (self.started_at or 0)
+
+class DagExecutor:
+    """
+    Runs a graph of stages, starting every stage as soon as all of its inputs exist. Every stage is timed
+    as a stage of the current job's metrics.
+
+    If a stage fails, no further stages are started; the stages already running are waited for and the
+    first error is raised.
+
+    :param stages: list of Stage - The graph; every input must be an initial artifact or another stage's output.
+    :param workers: dict - Concurrent stages per kind; kinds that are left out run one stage at a time.
+    :param on_start: callable - Optional callback receiving each stage as it starts.
+    """
+    def __init__(self, stages, workers=None, on_start=None):
+        self.stages = {stage.name: stage for stage in stages}
+        self.workers = workers or {}
+        self.on_start = on_start
+        self.producers = {}
+        for stage in stages:
+            for output in stage.outputs:
+                if output in self.producers:
+                    raise ValueError(f"Artifact {output} is produced by both {self.producers[output]} and {stage.name}")
+                self.producers[output] = stage.name
+        self.started_at = None
+
+    def check(self, artifacts):
+        for stage in self.stages.values():
+            missing = [name for name in stage.inputs if name not in artifacts and name not in self.producers]
+            if missing:
+                raise ValueError(f"Stage {stage.name} needs {', '.join(missing)}, which nothing produces")
+
+    def needed(self, artifacts, targets):
+        """
+        The stages that have to run to produce the targets, given the artifacts that already exist.
+
+        :param artifacts: dict - Initial artifacts, by name.
+        :param targets: iterable of str - Artifacts wanted.
+        :return: set of str - Names of the stages to run.
+        """
+        needed = set()
+        wanted = [name for name in targets if name not in artifacts]
+        while wanted:
+            name = wanted.pop()
+            if name not in self.producers:
+                raise ValueError(f"Nothing produces {name}")
+            stage = self.stages[self.producers[name]]
+            if stage.name not in needed:
+                needed.add(stage.name)
+                wanted.extend(artifact for artifact in stage.inputs if artifact not in artifacts)
+        return needed
+
+    def execute(self, stage, inputs):
+        stage.started_at = time.perf_counter()
+        try:
+            with timed_stage(stage.name):
+                result = stage.function(**inputs)
+        finally:
+            stage.finished_at = time.perf_counter()
+        if len(stage.outputs) == 1:
+            return {stage.outputs[0]: result}
+        return dict(result or {})
+
+    def run(self, artifacts, targets=None):
+        """
+        Run every stage, or only the stages the targets depend on.
+
+        :param artifacts: dict - Initial artifacts, by name.
+        :param targets: iterable of str - Optional artifacts wanted; stages whose outputs already exist or
+                                          are not needed for the targets are skipped.
+        :return: dict - All artifacts, including every stage's outputs.
+        """
+        artifacts = dict(artifacts)
+        self.check(artifacts)
+        self.started_at = time.perf_counter()
+        pending = dict(self.stages)
+        if targets is not None:
+            needed = self.needed(artifacts, targets)
+            pending = {name: stage for name, stage in pending.items() if name in needed}
+            logging.debug(f"Skipping stages that are not needed: {', '.join(sorted(set(self.stages) - needed)) or 'none'}")
+        running = {}
+        executors = {kind: ThreadPoolExecutor(max_workers=self.workers.get(kind, 1), thread_name_prefix=f"stage-{kind}")
+                     for kind in Stage.KINDS}
+        error = None
+        try:
+            while pending or running:
+                if error is None:
+                    for name, stage in list(pending.items()):
+                        if all(artifact in artifacts for artifact in stage.inputs):
+                            del pending[name]
+                            if self.on_start:
+                                self.on_start(stage)
+                            inputs = {artifact: artifacts[artifact] for artifact in stage.inputs}
+                            running[executors[stage.kind].submit(propagate(self.execute), stage, inputs)] = stage
+                if not running:
+                    if pending and error is None:
+                        raise RuntimeError(f"Stages can never start: {', '.join(pending)}")
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage = running.pop(future)
+                    try:
+                        outputs = future.result()
+                    except Exception as e:
+                        logging.error(f"Stage {stage.name} failed after {stage.seconds:.3f}s: {e}")
+                        error = error or e
+                        continue
+                    artifacts.update(outputs)
+                    logging.debug(f"Stage {stage.name} finished in {stage.seconds:.3f}s")
+        finally:
+            for executor in executors.values():
+                executor.shutdown(wait=True)
+
+        if error is not None:
+            raise error
+        return artifacts
+
+    def critical_path(self):
+        """
+        The chain of stages that determined the total run time: starting from the stage that finished last,
+        repeatedly step back to the input producer that finished last.
+
+        :return: list of Stage - The stages on the critical path, in execution order.
+        """
+        finished = [stage for stage in self.stages.values() if stage.finished_at is not None]
+        if not finished:
+            return []
+        path = [max(finished, key=lambda stage: stage.finished_at)]
+        while True:
+            producers = [self.stages[self.producers[name]] for name in path[-1].inputs if name in self.producers]
+            producers = [stage for stage in producers if stage.finished_at is not None]
+            if not producers:
+                break
+            path.append(max(producers, key=lambda stage: stage.finished_at))
+        return path[::-1]
+
+    def log_critical_path(self):
+        """
+        Log the critical path.
+
+        :return: list of dict - {"stage", "seconds"} per stage on the critical path.
+        """
+        path = self.critical_path()
+        if path:
+            steps = " -> ".join(f"{stage.name} ({stage.seconds:.3f}s)" for stage in path)
+            logging.info(f"Critical path ({path[-1].finished_at - self.started_at:.3f}s): {steps}")
+        return [{"stage": stage.name, "seconds": stage.seconds} for stage in path]
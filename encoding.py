@@ -0,0 +1,131 @@
+import logging
+import subprocess
+import threading
+
+class EncoderUnavailable(Exception):
+    """
+    Raised when the installed ffmpeg lacks an encoder or filter a render needs.
+    """
+
+_capabilities = None
+_capabilities_lock = threading.Lock()
+
+def parse_capability_list(output):
+    """
+    Read the names out of `ffmpeg -encoders` or `ffmpeg -filters` output, skipping the legend above the
+    dashed separator line.
+
+    :param output: str - The command's standard output.
+    :return: set of str - The encoder or filter names.
+    """
+    names = set()
+    lines = output.splitlines()
+    if any(line.strip().startswith("---") for line in lines):
+        lines = lines[next(i for i, line in enumerate(lines) if line.strip().startswith("---")) + 1:]
+    for line in lines:
+        fields = line.split()
+        if len(fields) >= 2:
+            names.add(fields[1])
+    return names
+
+def ffmpeg_capabilities():
+    """
+    The encoders and filters of the installed ffmpeg. ffmpeg is only asked once per process; every later
+    call returns the recorded result.
+
+    :return: dict - {"encoders": set of str, "filters": set of str}; both empty if ffmpeg could not be run.
+    """
+    global _capabilities
+    with _capabilities_lock:
+        if _capabilities is None:
+            capabilities = {}
+            for kind in ("encoders", "filters"):
+                try:
+                    result = subprocess.run(["ffmpeg", "-hide_banner", f"-{kind}"], stdout=subprocess.PIPE,
+                                            stderr=subprocess.PIPE, check=True)
+                    capabilities[kind] = parse_capability_list(result.stdout.decode("utf-8", errors="replace"))
+                except (OSError, subprocess.CalledProcessError) as e:
+                    logging.warning(f"Could not list the ffmpeg {kind}: {e}")
+                    capabilities[kind] = set()
+            logging.info(f"ffmpeg provides {len(capabilities['encoders'])} encoders and {len(capabilities['filters'])} filters")
+            _capabilities = capabilities
+        return _capabilities
+
+def require_filters(*names):
+    """
+    Fail early if the installed ffmpeg lacks any of the filters. Nothing is checked if ffmpeg could not
+    be probed; the render then fails in ffmpeg itself.
+    """
+    filters = ffmpeg_capabilities()["filters"]
+    missing = [name for name in names if filters and name not in filters]
+    if missing:
+        raise EncoderUnavailable(f"The installed ffmpeg lacks the {', '.join(missing)} filter(s)")
+
+class EncodingProfile:
+    """
+    Encoder settings shared by every encode of a render: clip trimming, concatenation and the final mux.
+
+    Video is always H.264, so encoded clips can still be joined with stream copied ones. libx264 is used
+    with the profile's preset and CRF; where ffmpeg was built without it, libopenh264 is used at a fixed
+    bitrate. Hardware encoders are not considered: being compiled in does not mean the device or driver
+    they need is present.
+
+    :param name: str - Profile name, as selected per request.
+    :param preset: str - libx264 preset.
+    :param crf: int - libx264 constant rate factor; higher is smaller and worse.
+    :param video_bitrate: str - Bitrate for H.264 encoders other than libx264.
+    :param audio_bitrate: str - AAC bitrate.
+    """
+    FALLBACK_VIDEO_ENCODERS = ("libopenh264",)
+
+    def __init__(self, name, preset, crf, video_bitrate, audio_bitrate):
+        self.name = name
+        self.preset = preset
+        self.crf = crf
+        self.video_bitrate = video_bitrate
+        self.audio_bitrate = audio_bitrate
+
+    def video_encoder(self):
+        encoders = ffmpeg_capabilities()["encoders"]
+        if not encoders or "libx264" in encoders:
+            return "libx264"
+        for encoder in self.FALLBACK_VIDEO_ENCODERS:
+            if encoder in encoders:
+                return encoder
+        raise EncoderUnavailable("The installed ffmpeg has no H.264 encoder")
+
+    def video_options(self):
+        """
+        :return: list - ffmpeg output options for the video stream.
+        """
+        encoder = self.video_encoder()
+        if encoder == "libx264":
+            return ["-c:v", "libx264", "-preset", self.preset, "-crf", str(self.crf)]
+        return ["-c:v", encoder, "-b:v", self.video_bitrate]
+
+    def audio_options(self):
+        """
+        :return: list - ffmpeg output options for the audio stream.
+        """
+        return ["-c:a", "aac", "-b:a", self.audio_bitrate]
+
+    def __repr__(self):
+        return f"EncodingProfile({self.name!r})"
+
+# Named profiles selectable per request
+ENCODING_PROFILES = {
+    "fast-preview": EncodingProfile("fast-preview", preset="ultrafast", crf=30, video_bitrate="1M", audio_bitrate="96k"),
+    # ffmpeg's own libx264 and AAC defaults, which every render used before profiles existed
+    "final": EncodingProfile("final", preset="medium", crf=23, video_bitrate="6M", audio_bitrate="128k"),
+}
+DEFAULT_ENCODING_PROFILE = "final"
+
+def get_encoding_profile(name):
+    """
+    :param name: str - Profile name, None for the default profile.
+    :return: EncodingProfile - The profile.
+    """
+    profile = ENCODING_PROFILES.get(name or DEFAULT_ENCODING_PROFILE)
+    if profile is None:
+        raise ValueError(f"Unknown encoding profile: {name}. Expected one of {', '.join(ENCODING_PROFILES)}")
+    return profile
@@ -0,0 +1,40 @@
+import time
+import random
+import logging
+import requests
+
+# Rate limited or temporarily unavailable; worth another attempt
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+def pooled_session(pool_size):
+    """
+    A session that keeps up to `pool_size` connections per host alive, for clients shared between threads.
+
+    :param pool_size: int - Connections kept alive, roughly the number of concurrent requests.
+    :return: requests.Session - The session.
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max(1, pool_size))
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def retry_after_seconds(response):
+    """
+    :return: float or None - The delay asked for in the response's Retry-After header, if it gives seconds.
+    """
+    retry_after = response.headers.get("Retry-After", "")
+    return float(retry_after) if retry_after.replace(".", "", 1).isdigit() else None
+
+def wait_before_retry(attempt, max_retries, delay=None):
+    """
+    Sleep before the next attempt: exponential backoff with jitter, capped at 30 seconds.
+
+    :param attempt: int - The attempt that just failed, counting from 0.
+    :param max_retries: int - Retries after the first attempt, for the log message.
+    :param delay: float - Optional delay that takes precedence, e.g. from a Retry-After header.
+    """
+    if delay is None:
+        delay = min(2 ** attempt, 30) + random.uniform(0, 1)
+    logging.info(f"Retrying in {delay:.1f}s... ({attempt + 1}/{max_retries})")
+    time.sleep(delay)
@@ -0,0 +1,204 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import sqlite3
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from pipeline import Pipeline
+from utils import link_or_copy, video_input_name, TEXT_INPUT_NAME
+
+class JobStore:
+    """
+    SQLite-backed store for job state, so job status and results survive a restart.
+    """
+    def __init__(self, db_path):
+        self.db_path = str(db_path)
+        self._lock = threading.Lock()
+        with self._connect() as connection:
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    stage TEXT,
+                    progress REAL NOT NULL DEFAULT 0,
+                    error TEXT,
+                    options TEXT NOT NULL,
+                    work_dir TEXT NOT NULL,
+                    inputs TEXT NOT NULL,
+                    outputs TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+
+    def _connect(self):
+        connection = sqlite3.connect(self.db_path, timeout=30)
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    def _execute(self, query, parameters=()):
+        with self._lock, self._connect() as connection:
+            return connection.execute(query, parameters).fetchall()
+
+    def create(self, job_id, options, work_dir, inputs):
+        now = time.time()
+        self._execute(
+            "INSERT INTO jobs (id, status, options, work_dir, inputs, created_at, updated_at) VALUES (?, 'queued', ?, ?, ?, ?, ?)",
+            (job_id, json.dumps(options), str(work_dir), json.dumps([str(path) for path in inputs]), now, now)
+        )
+
+    def update(self, job_id, **fields):
+        if 'outputs' in fields:
+            fields['outputs'] = json.dumps([str(path) for path in fields['outputs']])
+        fields['updated_at'] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        self._execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def get(self, job_id):
+        rows = self._execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+        if not rows:
+            return None
+        job = dict(rows[0])
+        for name in ('options', 'inputs', 'outputs'):
+            job[name] = json.loads(job[name]) if job[name] else []
+        return job
+
+    def unfinished(self):
+        return [row['id'] for row in self._execute("SELECT id FROM jobs WHERE status IN ('queued', 'running')")]
+
+    def delete(self, job_id):
+        self._execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+class JobManager:
+    """
+    Runs pipelines in the background on a bounded worker pool.
+
+    Each job gets its own directory under `jobs_dir` holding its inputs, intermediate files and outputs.
+    API keys are only kept in memory, so jobs interrupted by a restart are marked as failed rather than
+    resumed.
+
+    :param jobs_dir: Path - Directory for job directories and the job database.
+    :param max_workers: int - Maximum number of pipelines running at once.
+    """
+    def __init__(self, jobs_dir, max_workers=2):
+        self.jobs_dir = Path(jobs_dir)
+        self.jobs_dir.mkdir(parents=True, exist_ok=True)
+        self.store = JobStore(self.jobs_dir / "jobs.sqlite3")
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self.recover()
+
+    def recover(self):
+        for job_id in self.store.unfinished():
+            logging.warning(f"Job {job_id} was interrupted by a restart")
+            self.store.update(job_id, status='failed', error="Interrupted by a server restart, please resubmit")
+
+    def create_job_dir(self):
+        job_id = uuid.uuid4().hex
+        work_dir = self.jobs_dir / job_id
+        work_dir.mkdir()
+        return job_id, work_dir
+
+    def submit(self, job_id, options, text_path, video_path, reuse_dir=None):
+        """
+        Queue a pipeline run for inputs already saved in the job directory.
+
+        :param job_id: str - Id returned by `create_job_dir`.
+        :param options: dict - Pipeline options, including the API key.
+        :param text_path: Path - The saved script.
+        :param video_path: Path - The saved source video.
+        :param reuse_dir: Path - Optional work directory of an earlier job whose narration and alignments are reused.
+        """
+        stored_options = {name: value for name, value in options.items() if name != 'api_key'}
+        self.store.create(job_id, stored_options, self.jobs_dir / job_id, [text_path, video_path])
+        self.executor.submit(self.run_job, job_id, options, Path(text_path), Path(video_path), reuse_dir)
+        logging.debug(f"Queued job {job_id}")
+
+    def submit_render(self, parent_id, overrides):
+        """
+        Queue another render of a finished job, typically the full render of a preview. The narration and
+        both alignments are reused from the finished job, so no text-to-speech request or alignment is made
+        and no API key is needed.
+
+        :param parent_id: str - The finished job.
+        :param overrides: dict - Render options that differ from the finished job's (styling, music windows,
+                                 preview, encoding profile, ...).
+        :return: str - The new job's id, or None if the finished job does not exist.
+        """
+        parent = self.store.get(parent_id)
+        if parent is None:
+            return None
+        if parent['status'] != 'done':
+            raise ValueError(f"Job {parent_id} is {parent['status']}")
+
+        options = {**parent['options'], 'preview': False, **overrides, 'api_key': None, 'parent_job': parent_id}
+        if 'encoding_profile' not in overrides:
+            options['encoding_profile'] = 'fast-preview' if options['preview'] else 'final'
+        job_id, work_dir = self.create_job_dir()
+        parent_text, parent_video = parent['inputs']
+        text_path = link_or_copy(parent_text, work_dir / TEXT_INPUT_NAME)
+        video_path = link_or_copy(parent_video, work_dir / video_input_name(Path(parent_video).name))
+        self.submit(job_id, options, text_path, video_path, reuse_dir=Path(parent['work_dir']))
+        return job_id
+
+    def run_job(self, job_id, options, text_path, video_path, reuse_dir=None):
+        work_dir = self.jobs_dir / job_id
+        self.store.update(job_id, status='running')
+
+        def progress(stage, fraction):
+            self.store.update(job_id, stage=stage, progress=fraction)
+
+        try:
+            output_paths = Pipeline(options, work_dir, progress=progress, job_id=job_id).run(text_path, video_path, reuse_dir)
+            self.store.update(job_id, status='done', stage='done', progress=1.0, outputs=output_paths)
+            logging.debug(f"Job {job_id} finished")
+        except Exception as e:
+            logging.exception(f"Job {job_id} failed")
+            self.store.update(job_id, status='failed', error=str(e))
+
+    def artifacts(self, job_id):
+        """
+        The output files of a finished job.
+
+        :param job_id: str - The job id.
+        :return: dict - File name -> Path for every output that still exists.
+        """
+        job = self.store.get(job_id)
+        if job is None:
+            return {}
+        return {Path(path).name: Path(path) for path in job['outputs'] if os.path.exists(path)}
+
+    def options(self, job_id):
+        """
+        :return: dict - The options the job was submitted with; empty if the job does not exist.
+        """
+        job = self.store.get(job_id)
+        return job['options'] if job else {}
+
+    def status(self, job_id):
+        job = self.store.get(job_id)
+        if job is None:
+            return None
+        return {
+            "job_id": job['id'],
+            "status": job['status'],
+            "stage": job['stage'],
+            "progress": job['progress'],
+            "error": job['error'],
+            "artifacts": [Path(path).name for path in job['outputs']],
+            "created_at": job['created_at'],
+            "updated_at": job['updated_at'],
+        }
+
+    def delete(self, job_id):
+        job = self.store.get(job_id)
+        if job is None:
+            return False
+        if job['status'] in ('queued', 'running'):
+            raise ValueError(f"Job {job_id} is still {job['status']}")
+        shutil.rmtree(job['work_dir'], ignore_errors=True)
+        self.store.delete(job_id)
+        return True
@@ -1,17 +1,20 @@
 import os
 import logging
-from flask import Flask, request, send_file, jsonify
+import shutil
+import threading
+from flask import Flask, Request, Response, request, send_file, jsonify
 from flask_cors import CORS
+from werkzeug.exceptions import RequestEntityTooLarge
 from pathlib import Path
-from shutil import copyfile
-from tempfile import TemporaryDirectory
-from audio_generator import AudioGenerator
-from silence_remover import SilenceRemover
-from video_to_audio_converter import VideoToAudioConverter
-from run_aeneas import RunAeneas
-from utils import save_uploaded_file
+from tempfile import mkdtemp
+from job_queue import JobManager
+from video_to_audio_converter import NoAudioTrack
+from pipeline import Pipeline, MAX_CONCURRENT_JOBS, ALIGNMENT_WORKER_POOL, TTS_CACHE, MUSIC_CACHE, CLIP_CACHE, ALIGNMENT_CACHE
+from metrics import REGISTRY
 from video_processor import VideoProcessor
-import zipfile
+from encoding import ffmpeg_capabilities, ENCODING_PROFILES
+from streaming_zip import iter_zip
+from utils import save_uploaded_file, video_input_name, download_stem, download_name, UploadSpool, UploadTooLarge, InvalidUpload, TEXT_INPUT_NAME
 
 app = Flask(__name__)
 
@@ -20,165 +23,370 @@ CORS(app)
 
 logging.basicConfig(level=logging.DEBUG)
 
+# Upload limits: the whole request is rejected before parsing if it is larger than MAX_UPLOAD_BYTES, and
+# a file part as soon as it grows past MAX_VIDEO_BYTES while the request is parsed
+MAX_UPLOAD_BYTES = int(os.environ.get('MAX_UPLOAD_BYTES', 0)) or None
+MAX_VIDEO_BYTES = int(os.environ.get('MAX_VIDEO_BYTES', 0)) or None
+MAX_TEXT_BYTES = int(os.environ.get('MAX_TEXT_BYTES', 1024 * 1024))
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES
+
+# Background jobs: where job inputs/outputs and state live, and how many pipelines run at once
+JOBS_DIR = Path(os.environ.get('JOBS_DIR', Path.home() / '.local' / 'share' / 'video_processing_backend' / 'jobs'))
+job_manager = JobManager(JOBS_DIR, max_workers=MAX_CONCURRENT_JOBS)
+
+# Uploaded files are spooled next to the job directories, so saving them is a hard link rather than a copy
+UPLOAD_SPOOL_DIR = JOBS_DIR / '.uploads'
+UPLOAD_SPOOL_DIR.mkdir(parents=True, exist_ok=True)
+
+class UploadRequest(Request):
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        # The field name is not known here, so every file part is held to the largest per-file limit;
+        # the text limit is checked again when the part is saved
+        return UploadSpool(UPLOAD_SPOOL_DIR, max_bytes=MAX_VIDEO_BYTES,
+                           progress=upload_progress_logger(filename or 'upload'))
+
+app.request_class = UploadRequest
+
+# Load aeneas in the alignment workers in the background so the first job does not wait for it
+if ALIGNMENT_WORKER_POOL is not None:
+    threading.Thread(target=ALIGNMENT_WORKER_POOL.warm_up, daemon=True).start()
+
+# Record which encoders and filters the installed ffmpeg provides once, before any request needs them
+ffmpeg_capabilities()
+
+def cache_metrics():
+    """
+    Hit, miss and eviction counters and current size of the media caches, for the /metrics route.
+    """
+    samples = {
+        "media_cache_hits_total": [],
+        "media_cache_misses_total": [],
+        "media_cache_evictions_total": [],
+        "media_cache_bytes": [],
+    }
+    for cache in (TTS_CACHE, MUSIC_CACHE, CLIP_CACHE, ALIGNMENT_CACHE):
+        stats = cache.stats()
+        samples["media_cache_hits_total"].append(({"cache": cache.name}, stats["hits"]))
+        samples["media_cache_misses_total"].append(({"cache": cache.name}, stats["misses"]))
+        samples["media_cache_evictions_total"].append(({"cache": cache.name}, stats["evictions"]))
+        samples["media_cache_bytes"].append(({"cache": cache.name}, stats["bytes"]))
+    return samples
+
+REGISTRY.add_collector(cache_metrics)
+
+def one_of(*choices):
+    """
+    Build a form value parser that only accepts one of `choices`.
+    """
+    def parse(value):
+        if value not in choices:
+            raise ValueError(f"{value!r}, expected one of {', '.join(choices)}")
+        return value
+    return parse
+
+def read_choice(field, default, choices):
+    """
+    Read a form field that must be one of `choices`, so a bad value is refused before any work starts.
+    """
+    try:
+        return one_of(*choices)(request.form.get(field, default))
+    except ValueError as e:
+        raise InvalidUpload(f"Invalid {field}: {e}")
+
+def read_upload_options():
+    """
+    Read the pipeline options from the submitted form.
+
+    :return: dict - The pipeline options.
+    """
+    voice_id = request.form.get('voice_id')
+    api_key = request.form.get('api_key')
+    speed = request.form.get('speed')
+    set_speed_up = request.form.get('set_speed_up')
+    tts_chunked = request.form.get('tts_chunked') == 'on'  # Synthesize the text sentence by sentence
+    happy_start = int(request.form.get('happy_start'))
+    happy_end = int(request.form.get('happy_end'))
+    sad_start = int(request.form.get('sad_start'))
+    sad_end = int(request.form.get('sad_end'))
+    bg_width = int(request.form.get('subtitle_width', 650))
+    bg_height = int(request.form.get('subtitle_height', 120))
+    font_size = int(request.form.get('font_size', 35))
+    bottom_padding = int(request.form.get('bottom_padding', 50))
+    max_width = int(request.form.get('max_width', 500))  # New max width entry
+    render_engine = read_choice('render_engine', 'clips', VideoProcessor.RENDER_ENGINES)  # 'clips' or 'filtergraph'
+    stream_copy = request.form.get('stream_copy', 'on') == 'on'  # Copy fragments that fall on keyframes instead of encoding them
+    subtitle_mode = read_choice('subtitle_mode', 'remote', VideoProcessor.SUBTITLE_MODES)  # 'remote' subtitle service or 'local' ffmpeg rendering
+    bypass_alignment_cache = request.form.get('bypass_alignment_cache') == 'on'  # Realign even if cached
+    fused_narration = request.form.get('fused_narration', 'on') == 'on'  # Speed up and trim the narration in one pass
+    preview = request.form.get('preview') == 'on'  # Render a downscaled proxy; for jobs, request the full render with /jobs/<id>/render
+    preview_height = int(request.form.get('preview_height', 360))
+    encoding_profile = read_choice('encoding_profile', 'fast-preview' if preview else 'final', tuple(ENCODING_PROFILES))  # 'fast-preview' or 'final'
+
+    if not voice_id:
+        logging.debug("No voice_id provided")
+    if not api_key:
+        logging.debug("No api_key provided")
+
+    speed = float(speed) if speed else 1.15
+    set_speed_up = set_speed_up == 'on'  # Interpret checkbox value correctly
+
+    logging.debug(f"Voice ID: {voice_id}, Speed: {speed}, Set Speed Up: {set_speed_up}")
+    logging.debug(f"Happy Start: {happy_start}, Happy End: {happy_end}, Sad Start: {sad_start}, Sad End: {sad_end}")
+    logging.debug(f"Background Width: {bg_width}, Background Height: {bg_height}, Font Size: {font_size}, Bottom Padding: {bottom_padding}, Max Width: {max_width}")
+    logging.debug(f"Render engine: {render_engine}, Stream copy: {stream_copy}, Subtitle mode: {subtitle_mode}, Encoding profile: {encoding_profile}, Preview: {preview}, Chunked TTS: {tts_chunked}")
+
+    return {
+        'voice_id': voice_id,
+        'api_key': api_key,
+        'speed': speed,
+        'set_speed_up': set_speed_up,
+        'tts_chunked': tts_chunked,
+        'happy_start': happy_start,
+        'happy_end': happy_end,
+        'sad_start': sad_start,
+        'sad_end': sad_end,
+        'bg_width': bg_width,
+        'bg_height': bg_height,
+        'font_size': font_size,
+        'bottom_padding': bottom_padding,
+        'max_width': max_width,
+        'render_engine': render_engine,
+        'subtitle_mode': subtitle_mode,
+        'stream_copy': stream_copy,
+        'encoding_profile': encoding_profile,
+        'preview': preview,
+        'preview_height': preview_height,
+        'bypass_alignment_cache': bypass_alignment_cache,
+        'fused_narration': fused_narration,
+        # Inputs are saved under fixed names; downloads are named after the client's text file again
+        'download_stem': download_stem(getattr(request.files.get('text'), 'filename', None)),
+    }
+
+# Options a render of a finished job may change: form field -> (option name, parser)
+RENDER_OPTION_FIELDS = {
+    'happy_start': ('happy_start', int),
+    'happy_end': ('happy_end', int),
+    'sad_start': ('sad_start', int),
+    'sad_end': ('sad_end', int),
+    'subtitle_width': ('bg_width', int),
+    'subtitle_height': ('bg_height', int),
+    'font_size': ('font_size', int),
+    'bottom_padding': ('bottom_padding', int),
+    'max_width': ('max_width', int),
+    'render_engine': ('render_engine', one_of(*VideoProcessor.RENDER_ENGINES)),
+    'subtitle_mode': ('subtitle_mode', one_of(*VideoProcessor.SUBTITLE_MODES)),
+    'stream_copy': ('stream_copy', lambda value: value == 'on'),
+    'encoding_profile': ('encoding_profile', one_of(*ENCODING_PROFILES)),
+    'preview': ('preview', lambda value: value == 'on'),
+    'preview_height': ('preview_height', int),
+}
+
+def read_render_options():
+    """
+    Read the render options submitted to re-render a finished job. Fields that are left out keep the
+    finished job's values.
+
+    :return: dict - The changed options.
+    """
+    overrides = {}
+    for field, (name, parse) in RENDER_OPTION_FIELDS.items():
+        value = request.form.get(field)
+        if value is not None:
+            try:
+                overrides[name] = parse(value)
+            except ValueError as e:
+                raise ValueError(f"{field}: {e}")
+    logging.debug(f"Render options: {overrides}")
+    return overrides
+
+def upload_progress_logger(name, every=64 * 1024 * 1024):
+    """
+    Build a progress callback for an UploadSpool that logs every `every` bytes received while the upload arrives.
+    """
+    last_reported = 0
+
+    def progress(received):
+        nonlocal last_reported
+        if received - last_reported >= every:
+            last_reported = received
+            logging.debug(f"Received {received // (1024 * 1024)} MB of {name}")
+    return progress
+
+def save_upload_inputs(work_dir):
+    """
+    Save the uploaded text and video files into the working directory.
+
+    :param work_dir: Path - Directory to save the files to.
+    :return: tuple of Path - The saved text and video paths.
+    """
+    text_file = request.files.get('text')
+    video_file = request.files.get('video')
+
+    if not text_file:
+        raise InvalidUpload("No text file uploaded")
+    if not video_file:
+        raise InvalidUpload("No video file uploaded")
+
+    logging.debug(f"Text file: {text_file.filename}")
+    logging.debug(f"Video file: {video_file.filename}")
+
+    # The client's file names are not used as paths; the files are saved under fixed names
+    video_name = video_input_name(video_file.filename)
+    text_path, text_digest = save_uploaded_file(text_file, work_dir / TEXT_INPUT_NAME, max_bytes=MAX_TEXT_BYTES)
+    video_path, video_digest = save_uploaded_file(video_file, work_dir / video_name, max_bytes=MAX_VIDEO_BYTES)
+
+    logging.debug(f"Saved text file to {text_path} (sha256 {text_digest})")
+    logging.debug(f"Saved video file to {video_path} (sha256 {video_digest})")
+
+    # Verify files exist after saving
+    if not os.path.exists(text_path):
+        logging.error(f"Text file does not exist after saving: {text_path}")
+    if not os.path.exists(video_path):
+        logging.error(f"Video file does not exist after saving: {video_path}")
+
+    return text_path, video_path
+
+def zip_response(output_paths, stem=None):
+    """
+    Stream the output files to the client as a zip archive generated on the fly.
+
+    :param stem: str - Stem from download_stem to name the outputs derived from the text input after.
+    """
+    return Response(
+        iter_zip(output_paths, arcnames=[download_name(path, stem) for path in output_paths]),
+        mimetype='application/zip',
+        headers={'Content-Disposition': 'attachment; filename=output_files.zip'}
+    )
+
 @app.route('/upload', methods=['POST'])
 def upload_file():
     try:
         logging.debug("Received request")
+        options = read_upload_options()
+
+        # Create a temporary directory to save the files; it is removed once the response has been sent
+        temp_path = Path(mkdtemp())
+        try:
+            text_path, video_path = save_upload_inputs(temp_path)
+            Pipeline.check_inputs(video_path)
+            output_paths = Pipeline(options, temp_path).run(text_path, video_path)
+            response = zip_response(output_paths, options['download_stem'])
+        except Exception:
+            shutil.rmtree(temp_path, ignore_errors=True)
+            raise
+        response.call_on_close(lambda: shutil.rmtree(temp_path, ignore_errors=True))
+        return response
+
+    except (UploadTooLarge, RequestEntityTooLarge) as e:
+        logging.debug(f"Rejected upload: {str(e)}")
+        return jsonify({"error": str(e)}), 413
+    except InvalidUpload as e:
+        logging.debug(f"Rejected upload: {str(e)}")
+        return jsonify({"error": str(e)}), 400
+    except NoAudioTrack as e:
+        logging.debug(f"Rejected upload: {str(e)}")
+        return jsonify({"error": str(e)}), 422
+    except Exception as e:
+        logging.debug(f"Error: {str(e)}")
+        return jsonify({"error": str(e)}), 500
 
-        # Get the uploaded files and form data
-        text_file = request.files.get('text')
-        video_file = request.files.get('video')
-        voice_id = request.form.get('voice_id')
-        api_key = request.form.get('api_key')
-        speed = request.form.get('speed')
-        set_speed_up = request.form.get('set_speed_up')
-        happy_start = int(request.form.get('happy_start'))
-        happy_end = int(request.form.get('happy_end'))
-        sad_start = int(request.form.get('sad_start'))
-        sad_end = int(request.form.get('sad_end'))
-        bg_width = int(request.form.get('subtitle_width', 650))
-        bg_height = int(request.form.get('subtitle_height', 120))
-        font_size = int(request.form.get('font_size', 35))
-        bottom_padding = int(request.form.get('bottom_padding', 50))
-        max_width = int(request.form.get('max_width', 500))  # New max width entry
-
-        if not text_file:
-            logging.debug("No text file uploaded")
-        if not video_file:
-            logging.debug("No video file uploaded")
-        if not voice_id:
-            logging.debug("No voice_id provided")
-        if not api_key:
-            logging.debug("No api_key provided")
-
-        speed = float(speed) if speed else 1.15
-        set_speed_up = set_speed_up == 'on'  # Interpret checkbox value correctly
-
-        logging.debug(f"Text file: {text_file.filename if text_file else 'None'}")
-        logging.debug(f"Video file: {video_file.filename if video_file else 'None'}")
-        logging.debug(f"Voice ID: {voice_id}, API Key: {api_key}, Speed: {speed}, Set Speed Up: {set_speed_up}")
-        logging.debug(f"Happy Start: {happy_start}, Happy End: {happy_end}, Sad Start: {sad_start}, Sad End: {sad_end}")
-        logging.debug(f"Background Width: {bg_width}, Background Height: {bg_height}, Font Size: {font_size}, Bottom Padding: {bottom_padding}, Max Width: {max_width}")
-
-        # Create instances of AudioGenerator, SilenceRemover, and VideoToAudioConverter
-        audio_generator = AudioGenerator(api_key, speed, set_speed_up)
-        silence_remover = SilenceRemover()
-        video_to_audio_converter = VideoToAudioConverter()
-
-        # Create a temporary directory to save the files
-        with TemporaryDirectory() as temp_dir:
-            temp_path = Path(temp_dir)
-
-            # Save the uploaded text and video files
-            text_path = temp_path / text_file.filename
-            video_path = temp_path / video_file.filename
-            save_uploaded_file(text_file, text_path)
-            save_uploaded_file(video_file, video_path)
-
-            logging.debug(f"Saved text file to {text_path}")
-            logging.debug(f"Saved video file to {video_path}")
-
-            # Verify files exist after saving
-            if not os.path.exists(text_path):
-                logging.error(f"Text file does not exist after saving: {text_path}")
-            if not os.path.exists(video_path):
-                logging.error(f"Video file does not exist after saving: {video_path}")
-
-            # Define the output audio file paths
-            extracted_audio_path = video_path.with_suffix('.mp3')
-            generated_audio_path = text_path.with_suffix('.gen.mp3')
-            trimmed_audio_path = text_path.with_suffix('.trimmed.mp3')
-
-            # Convert the video to audio
-            video_to_audio_converter.convert_mp4_to_mp3(video_path, extracted_audio_path)
-            logging.debug(f"Extracted audio path: {extracted_audio_path}")
-
-            # Verify extracted audio file exists
-            if not os.path.exists(extracted_audio_path):
-                logging.error(f"Extracted audio file does not exist: {extracted_audio_path}")
-
-            # Generate the audio file from the text
-            audio_generator.generate_audio(text_path, generated_audio_path, voice_id)
-            logging.debug(f"Generated audio path: {generated_audio_path}")
-
-            # Verify generated audio file exists
-            if not os.path.exists(generated_audio_path):
-                logging.error(f"Generated audio file does not exist: {generated_audio_path}")
-
-            # Trim silence from the generated audio file
-            silence_remover.trim_silence(generated_audio_path, trimmed_audio_path)
-            logging.debug(f"Trimmed audio path: {trimmed_audio_path}")
-
-            # Verify trimmed audio file exists
-            if not os.path.exists(trimmed_audio_path):
-                logging.error(f"Trimmed audio file does not exist: {trimmed_audio_path}")
-
-            # Copy background music files to the temporary directory
-            bgm_happy_path = temp_path / "happy.mp3"
-            bgm_sad_path = temp_path / "sad.mp3"
-            copyfile(Path(__file__).parent / "happy.mp3", bgm_happy_path)
-            copyfile(Path(__file__).parent / "sad.mp3", bgm_sad_path)
-
-            # Prepare input pairs for RunAeneas
-            input_pairs = [
-                (trimmed_audio_path, text_path),  # Use the silence-removed audio first
-                (extracted_audio_path, text_path)  # Use the audio extracted from the video second
-            ]
-
-            # Create and run RunAeneas instance
-            run_aeneas = RunAeneas(input_pairs)
-            run_aeneas.run()
-
-            # Collect the generated SRT files
-            new_timestamps_srt = text_path.with_stem(text_path.stem + '_new_timestamps').with_suffix('.srt')
-            old_timestamps_srt = text_path.with_stem(text_path.stem + '_old_timestamps').with_suffix('.srt')
-
-            logging.debug(f"New timestamps SRT: {new_timestamps_srt}")
-            logging.debug(f"Old timestamps SRT: {old_timestamps_srt}")
-
-            # Verify SRT files exist
-            if not os.path.exists(new_timestamps_srt):
-                logging.error(f"New timestamps SRT file does not exist: {new_timestamps_srt}")
-            if not os.path.exists(old_timestamps_srt):
-                logging.error(f"Old timestamps SRT file does not exist: {old_timestamps_srt}")
-
-            # Create and run VideoProcessor instance
-            video_processor = VideoProcessor(
-                new_mp3_path=trimmed_audio_path,
-                srt_path_new=new_timestamps_srt,
-                srt_path_old=old_timestamps_srt,
-                video_path=video_path,
-                bgm_happy_path=bgm_happy_path,
-                bgm_sad_path=bgm_sad_path,
-                happy_start=happy_start,
-                happy_end=happy_end,
-                sad_start=sad_start,
-                sad_end=sad_end,
-                bg_width=bg_width,
-                bg_height=bg_height,
-                font_size=font_size,
-                bottom_padding=bottom_padding,
-                max_width=max_width,  # Pass max width to VideoProcessor
-                output_dir=temp_path
-            )
-            final_video_path = video_processor.process_video()
-
-            # Zip the SRT files, the silence-removed audio, and the final video
-            zip_path = temp_path / "output_files.zip"
-            with zipfile.ZipFile(zip_path, 'w') as zf:
-                zf.write(new_timestamps_srt, new_timestamps_srt.name)
-                zf.write(old_timestamps_srt, old_timestamps_srt.name)
-                zf.write(trimmed_audio_path, trimmed_audio_path.name)  # Add the silence-removed audio
-                zf.write(final_video_path, final_video_path.name)  # Add the final video
-
-            logging.debug(f"Zipped output files: {zip_path}")
-
-            return send_file(zip_path, as_attachment=True, download_name="output_files.zip")
+def job_links(job_id):
+    return {
+        "job_id": job_id,
+        "status_url": f"/jobs/{job_id}",
+        "result_url": f"/jobs/{job_id}/result",
+        "artifacts_url": f"/jobs/{job_id}/artifacts/"
+    }
 
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    try:
+        logging.debug("Received job submission")
+        options = read_upload_options()
+        job_id, work_dir = job_manager.create_job_dir()
+        try:
+            text_path, video_path = save_upload_inputs(work_dir)
+            Pipeline.check_inputs(video_path)
+        except Exception:
+            shutil.rmtree(work_dir, ignore_errors=True)  # Do not keep partial uploads around
+            raise
+        job_manager.submit(job_id, options, text_path, video_path)
+        return jsonify(job_links(job_id)), 202
+
+    except (UploadTooLarge, RequestEntityTooLarge) as e:
+        logging.debug(f"Rejected upload: {str(e)}")
+        return jsonify({"error": str(e)}), 413
+    except InvalidUpload as e:
+        logging.debug(f"Rejected upload: {str(e)}")
+        return jsonify({"error": str(e)}), 400
+    except NoAudioTrack as e:
+        logging.debug(f"Rejected upload: {str(e)}")
+        return jsonify({"error": str(e)}), 422
     except Exception as e:
         logging.debug(f"Error: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/jobs/<job_id>/render', methods=['POST'])
+def render_job(job_id):
+    """
+    Render a finished job again, by default at full resolution with the final encoding profile (e.g. after
+    a preview). Its narration and alignments are reused; only the changed render options need to be sent.
+    """
+    try:
+        overrides = read_render_options()
+    except ValueError as e:
+        return jsonify({"error": f"Invalid render option: {e}"}), 400
+    try:
+        render_id = job_manager.submit_render(job_id, overrides)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 409
+    if render_id is None:
+        return jsonify({"error": f"Unknown job: {job_id}"}), 404
+    return jsonify({**job_links(render_id), "parent_job_id": job_id}), 202
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    status = job_manager.status(job_id)
+    if status is None:
+        return jsonify({"error": f"Unknown job: {job_id}"}), 404
+    return jsonify(status)
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    status = job_manager.status(job_id)
+    if status is None:
+        return jsonify({"error": f"Unknown job: {job_id}"}), 404
+    if status['status'] != 'done':
+        return jsonify({"error": f"Job is {status['status']}", **status}), 409
+    return zip_response(list(job_manager.artifacts(job_id).values()), job_manager.options(job_id).get('download_stem'))
+
+@app.route('/jobs/<job_id>/artifacts/<name>', methods=['GET'])
+def job_artifact(job_id, name):
+    """
+    Send a single output file. Range requests are supported, so large videos can be resumed or seeked.
+    """
+    artifact_path = job_manager.artifacts(job_id).get(name)
+    if artifact_path is None:
+        return jsonify({"error": f"Unknown artifact: {name}"}), 404
+    return send_file(artifact_path, as_attachment=True, download_name=name, conditional=True)
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def delete_job(job_id):
+    try:
+        if not job_manager.delete(job_id):
+            return jsonify({"error": f"Unknown job: {job_id}"}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 409
+    return '', 204
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    Stage timings, child process usage and cache counters of all jobs run by this process, in the
+    Prometheus text format.
+    """
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
 if __name__ == '__main__':
     logging.debug("Starting Flask app")
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
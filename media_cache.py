@@ -0,0 +1,183 @@
+import os
+import json
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+class CacheBackend(ABC):
+    """
+    Storage backend interface for content-addressed caches.
+
+    Backends map a key built with `make_key` to a file. Callers only use `fetch`, `store`, `store_bytes`
+    and `stats`, so a backend can keep its files anywhere; implementations must be safe to share between
+    threads.
+    """
+    name = "cache"
+
+    @staticmethod
+    def make_key(*parts):
+        """
+        Build a cache key from the values that identify an entry.
+
+        :param parts: Any JSON serializable values (paths and other objects are converted with str).
+        :return: str - Hex digest identifying the entry.
+        """
+        payload = json.dumps(parts, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    @abstractmethod
+    def fetch(self, key, destination):
+        """
+        Copy a cached entry to the destination path.
+
+        :param key: str - Cache key.
+        :param destination: Path - Where to copy the cached file.
+        :return: bool - True on a cache hit, False on a miss.
+        """
+
+    @abstractmethod
+    def store(self, key, source):
+        """
+        Add a file to the cache.
+
+        :param key: str - Cache key.
+        :param source: Path - File to cache.
+        """
+
+    @abstractmethod
+    def store_bytes(self, key, data):
+        """
+        Add an entry held in memory to the cache, without writing it to a file first.
+
+        :param key: str - Cache key.
+        :param data: bytes - The entry's contents.
+        """
+
+    def stats(self):
+        return {"name": self.name}
+
+class MediaCache(CacheBackend):
+    """
+    Content-addressed cache of media files in a local directory.
+
+    Entries are stored under a hash of whatever identifies them (source file digests, trim windows,
+    settings, ...). The cache is bounded by size: once it grows past `max_bytes`, the least recently
+    used entries are evicted first.
+
+    The directory is scanned once, when the cache is created; from then on the entries, their order of
+    use and their total size are tracked in memory, so storing an entry does not rescan the directory.
+    """
+    def __init__(self, cache_dir, max_bytes=2 * 1024 ** 3, name="media"):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # Key -> size of every entry, least recently used first
+        self._index = OrderedDict((path.name, size) for _, size, path in self.entries())
+        self._bytes = sum(self._index.values())
+
+    def entry_path(self, key):
+        return self.cache_dir / key[:2] / key
+
+    def fetch(self, key, destination):
+        path = self.entry_path(key)
+        # Copied without holding the lock; an entry evicted mid-copy stays readable through the open file
+        try:
+            shutil.copyfile(path, destination)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+                self._bytes -= self._index.pop(key, 0)
+            logging.debug(f"{self.name} cache miss: {key}")
+            return False
+        try:
+            os.utime(path)  # Mark the entry as recently used, for the next scan
+        except FileNotFoundError:
+            pass
+        with self._lock:
+            self.hits += 1
+            if key in self._index:
+                self._index.move_to_end(key)
+        logging.debug(f"{self.name} cache hit: {key}")
+        return True
+
+    def store(self, key, source):
+        def copy(temp_file):
+            with open(source, 'rb') as source_file:
+                shutil.copyfileobj(source_file, temp_file)
+        self._write_entry(key, copy)
+
+    def store_bytes(self, key, data):
+        self._write_entry(key, lambda temp_file: temp_file.write(data))
+
+    def _write_entry(self, key, write):
+        # Evicts old entries afterwards if the cache is over its size limit
+        path = self.entry_path(key)
+        os.makedirs(path.parent, exist_ok=True)
+        # Write to a temporary name first so readers never see a partially written entry
+        fd, temp_name = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, 'wb') as temp_file:
+                write(temp_file)
+            size = os.path.getsize(temp_name)
+            os.replace(temp_name, path)
+        except BaseException:
+            os.unlink(temp_name)
+            raise
+        logging.debug(f"{self.name} cache stored: {key}")
+        with self._lock:
+            self._bytes += size - self._index.pop(key, 0)
+            self._index[key] = size
+            self.evict()
+
+    def entries(self):
+        """
+        List the cache entries on disk, least recently used first.
+
+        :return: list of tuples - (mtime, size, path) for every entry.
+        """
+        entries = []
+        for path in self.cache_dir.glob("*/*"):
+            if path.name.startswith("."):
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return sorted(entries)
+
+    def evict(self):
+        """
+        Remove least recently used entries until the cache fits in `max_bytes`. Call with the lock held.
+        """
+        while self._bytes > self.max_bytes and self._index:
+            key, size = self._index.popitem(last=False)
+            try:
+                self.entry_path(key).unlink()
+            except FileNotFoundError:
+                pass
+            self._bytes -= size
+            self.evictions += 1
+            logging.debug(f"{self.name} cache evicted: {key}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "name": self.name,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._index),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
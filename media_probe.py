@@ -0,0 +1,70 @@
+import json
+import subprocess
+from metrics import run_process
+
+class ProbeError(Exception):
+    """
+    Raised when ffprobe cannot read a media file.
+    """
+
+def run_ffprobe(arguments):
+    """
+    Run ffprobe quietly and return what it printed.
+
+    :param arguments: list - Arguments after "ffprobe".
+    :return: str - ffprobe's standard output.
+    """
+    command = ["ffprobe", "-v", "error", *[str(argument) for argument in arguments]]
+    result = run_process(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise ProbeError(f"ffprobe exited with status {result.returncode}: {result.stderr.decode('utf-8', errors='replace').strip()}")
+    return result.stdout.decode("utf-8")
+
+def probe_media(path):
+    """
+    Read the container duration and the parameters of every stream.
+
+    :param path: Path - The media file.
+    :return: dict - {"duration": float or None, "streams": [dict, ...]} with ffprobe's stream fields.
+    """
+    output = json.loads(run_ffprobe([
+        "-show_entries",
+        "format=duration:stream=index,codec_type,codec_name,profile,width,height,pix_fmt,r_frame_rate,sample_rate,channels",
+        "-of", "json", path
+    ]))
+    duration = output.get("format", {}).get("duration")
+    return {
+        "duration": float(duration) if duration not in (None, "N/A") else None,
+        "streams": output.get("streams", []),
+    }
+
+def first_stream(media, codec_type):
+    """
+    :return: dict or None - The first stream of the given type ("video", "audio") in a probe_media result.
+    """
+    return next((stream for stream in media["streams"] if stream.get("codec_type") == codec_type), None)
+
+def probe_video_packets(path):
+    """
+    List the packets of the first video stream.
+
+    Only packet headers are read, nothing is decoded, so this is fast even for long videos.
+
+    :param path: Path - The video file.
+    :return: tuple of lists - Presentation times in seconds of every frame and of the keyframes, in ascending order.
+    """
+    output = run_ffprobe([
+        "-select_streams", "v:0",
+        "-show_entries", "packet=pts_time,flags",
+        "-of", "csv=print_section=0", path
+    ])
+    frames = []
+    keyframes = []
+    for line in output.splitlines():
+        pts_time, _, flags = line.strip().partition(",")
+        if pts_time in ("", "N/A"):
+            continue
+        frames.append(float(pts_time))
+        if "K" in flags:
+            keyframes.append(float(pts_time))
+    return sorted(frames), sorted(keyframes)
@@ -0,0 +1,230 @@
+import os
+import json
+import time
+import logging
+import threading
+import contextvars
+import subprocess
+from contextlib import contextmanager
+
+# The job being processed and the stage it is in, for whatever code runs on its behalf
+_current_job = contextvars.ContextVar("current_job", default=None)
+_current_stage = contextvars.ContextVar("current_stage", default=None)
+
+# Linux reports block I/O in 512-byte units
+BLOCK_SIZE = 512
+
+def new_stage_record():
+    return {
+        "runs": 0,
+        "wall_seconds": 0.0,
+        "child_cpu_seconds": 0.0,
+        "subprocesses": 0,
+        "bytes_read": 0,
+        "bytes_written": 0,
+        "bytes_uploaded": 0,
+        "upload_seconds": 0.0,
+        "bytes_downloaded": 0,
+        "download_seconds": 0.0,
+    }
+
+class MetricsRegistry:
+    """
+    Process-wide totals across all jobs, rendered in the Prometheus text format.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages = {}
+        self.jobs = {}
+        self.job_seconds = 0.0
+        self.jobs_in_progress = 0
+        self.collectors = []
+
+    def add_collector(self, collector):
+        """
+        Register a callable returning extra {metric name: [(labels dict, value), ...]} samples at scrape time.
+        """
+        self.collectors.append(collector)
+
+    def job_started(self):
+        with self._lock:
+            self.jobs_in_progress += 1
+
+    def job_finished(self, job_metrics, status):
+        with self._lock:
+            self.jobs_in_progress -= 1
+            self.jobs[status] = self.jobs.get(status, 0) + 1
+            self.job_seconds += job_metrics.total_seconds()
+            for name, record in job_metrics.stages.items():
+                totals = self.stages.setdefault(name, new_stage_record())
+                for field, value in record.items():
+                    totals[field] += value
+
+    def render(self):
+        with self._lock:
+            samples = {
+                "pipeline_jobs_total": [({"status": status}, count) for status, count in sorted(self.jobs.items())],
+                "pipeline_jobs_in_progress": [({}, self.jobs_in_progress)],
+                "pipeline_job_seconds_total": [({}, self.job_seconds)],
+            }
+            for field in new_stage_record():
+                samples[f"pipeline_stage_{field}_total"] = [
+                    ({"stage": name}, record[field]) for name, record in sorted(self.stages.items())
+                ]
+        for collector in self.collectors:
+            samples.update(collector())
+
+        lines = []
+        for metric, values in samples.items():
+            lines.append(f"# TYPE {metric} {'gauge' if not metric.endswith('_total') else 'counter'}")
+            for labels, value in values:
+                label_text = ",".join(f'{name}="{label}"' for name, label in labels.items())
+                lines.append(f"{metric}{{{label_text}}} {value}" if label_text else f"{metric} {value}")
+        return "\n".join(lines) + "\n"
+
+REGISTRY = MetricsRegistry()
+
+class JobMetrics:
+    """
+    Per-job record of where the time goes: wall time per stage, plus the CPU time, block I/O and count of
+    the child processes (ffmpeg, aeneas) each stage spawned.
+
+    Stages nest; a nested stage is recorded as "parent.child" and its time is included in the parent's.
+    """
+    def __init__(self, job_id=None):
+        self.job_id = job_id
+        self.stages = {}
+        self.started_at = time.time()
+        self.finished_at = None
+        self.critical_path = []  # {"stage", "seconds"} per stage that determined the total time
+        self._lock = threading.Lock()
+
+    def record(self, stage_name, **values):
+        with self._lock:
+            record = self.stages.setdefault(stage_name or "other", new_stage_record())
+            for field, value in values.items():
+                record[field] += value
+
+    def total_seconds(self):
+        return (self.finished_at or time.time()) - self.started_at
+
+    @contextmanager
+    def activate(self):
+        """
+        Make this the current job for the calling context until the block exits.
+        """
+        token = _current_job.set(self)
+        REGISTRY.job_started()
+        status = "failed"
+        try:
+            yield self
+            status = "done"
+        finally:
+            self.finished_at = time.time()
+            REGISTRY.job_finished(self, status)
+            _current_job.reset(token)
+
+    def manifest(self):
+        return {
+            "job_id": self.job_id,
+            "started_at": self.started_at,
+            "total_seconds": self.total_seconds(),
+            "stages": [{"stage": name, **record} for name, record in self.stages.items()],
+            "critical_path": self.critical_path,
+        }
+
+    def write_manifest(self, path):
+        with open(path, "w") as f:
+            json.dump(self.manifest(), f, indent=4)
+        return path
+
+@contextmanager
+def stage(name):
+    """
+    Time a pipeline stage of the current job. Does nothing outside of a job.
+
+    :param name: str - Stage name; nested stages are prefixed with their parent's name.
+    """
+    job_metrics = _current_job.get()
+    parent = _current_stage.get()
+    full_name = f"{parent}.{name}" if parent else name
+    token = _current_stage.set(full_name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _current_stage.reset(token)
+        if job_metrics is not None:
+            job_metrics.record(full_name, runs=1, wall_seconds=time.perf_counter() - start)
+            logging.debug(f"Stage {full_name} took {time.perf_counter() - start:.3f}s")
+
+def record_process(cpu_seconds, bytes_read=0, bytes_written=0, spawned=True):
+    """
+    Attribute a child process's resource use to the current stage of the current job.
+    """
+    job_metrics = _current_job.get()
+    if job_metrics is not None:
+        job_metrics.record(_current_stage.get(), child_cpu_seconds=cpu_seconds, subprocesses=int(spawned),
+                           bytes_read=bytes_read, bytes_written=bytes_written)
+
+def record_transfer(bytes_uploaded=0, upload_seconds=0.0, bytes_downloaded=0, download_seconds=0.0):
+    """
+    Attribute network transfers to external services to the current stage of the current job.
+    """
+    job_metrics = _current_job.get()
+    if job_metrics is not None:
+        job_metrics.record(_current_stage.get(), bytes_uploaded=bytes_uploaded, upload_seconds=upload_seconds,
+                           bytes_downloaded=bytes_downloaded, download_seconds=download_seconds)
+
+def propagate(function):
+    """
+    Wrap a function so it runs in a copy of the caller's context, e.g. when submitted to a thread pool,
+    and keeps reporting to the caller's job and stage.
+    """
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(function, *args, **kwargs)
+
+def _read_pipe(pipe, output, index):
+    with pipe:
+        output[index] = pipe.read()
+
+def _wait_with_rusage(process):
+    """
+    Read the child's output pipes to the end, then reap the child with os.wait4, which returns its
+    resource usage as well as its exit status. Popen.wait would reap the child without it.
+
+    :param process: subprocess.Popen - The running child.
+    :return: tuple - (stdout, stderr, resource usage).
+    """
+    output = [None, None]
+    readers = [
+        threading.Thread(target=_read_pipe, args=(pipe, output, index), daemon=True)
+        for index, pipe in enumerate((process.stdout, process.stderr)) if pipe is not None
+    ]
+    for reader in readers:
+        reader.start()
+    for reader in readers:
+        reader.join()
+    _, status, rusage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return output[0], output[1], rusage
+
+def run_process(command, check=False, **kwargs):
+    """
+    Equivalent of subprocess.run that records the child's CPU time and block I/O against the current stage.
+    """
+    with subprocess.Popen(command, **kwargs) as process:
+        try:
+            stdout, stderr, rusage = _wait_with_rusage(process)
+        except BaseException:
+            process.kill()
+            raise
+    record_process(
+        rusage.ru_utime + rusage.ru_stime,
+        bytes_read=rusage.ru_inblock * BLOCK_SIZE,
+        bytes_written=rusage.ru_oublock * BLOCK_SIZE
+    )
+    result = subprocess.CompletedProcess(process.args, process.returncode, stdout, stderr)
+    if check:
+        result.check_returncode()
+    return result
@@ -0,0 +1,38 @@
+from pydub import AudioSegment
+from silence_remover import SilenceRemover
+
+class NarrationProcessor:
+    """
+    Post-process generated narration in a single pass.
+
+    The narration is decoded once, sped up and trimmed of silence in memory, and encoded once, instead
+    of being decoded and re-encoded to MP3 by every step. Optionally a lossless PCM WAV copy is written
+    as well, for the alignment and mixing stages.
+
+    :param speed: float - Playback speed (1 keeps the original speed).
+    :param silence_remover: SilenceRemover - Used to trim silence; a default one is created if omitted.
+    """
+    def __init__(self, speed=1.0, silence_remover=None):
+        self.speed = speed
+        self.silence_remover = silence_remover or SilenceRemover()
+
+    def process(self, input_path, output_path, pcm_output_path=None):
+        """
+        Speed up and trim the narration.
+
+        :param input_path: Path - The generated narration.
+        :param output_path: Path - Where to write the processed narration as MP3.
+        :param pcm_output_path: Path - Optional path for a lossless WAV copy of the processed narration.
+        """
+        audio = AudioSegment.from_file(input_path)
+
+        if self.speed != 1:
+            audio = audio.speedup(playback_speed=self.speed)
+
+        audio = self.silence_remover.trim_segment(audio)
+
+        audio.export(output_path, format="mp3")
+        print(f"Processed narration saved to: {output_path}")
+        if pcm_output_path:
+            audio.export(pcm_output_path, format="wav")
+            print(f"Processed narration saved to: {pcm_output_path}")
@@ -0,0 +1,285 @@
+import os
+import logging
+from pathlib import Path
+from audio_generator import AudioGenerator, ELEVENLABS_API_URL
+from silence_remover import SilenceRemover
+from narration_processor import NarrationProcessor
+from video_to_audio_converter import VideoToAudioConverter, NoAudioTrack
+from run_aeneas import RunAeneas
+from aeneas_worker import AeneasWorkerPool
+from media_cache import MediaCache
+from video_processor import VideoProcessor, SUBTITLE_SERVICE_URL
+from subtitle_client import SubtitleClient
+from http_retry import pooled_session
+from utils import file_digest, link_or_copy
+from metrics import JobMetrics
+from dag import Stage, DagExecutor
+from encoding import get_encoding_profile
+
+# Number of pipelines run at once by the job queue; per-job pools are sized so that together they fit the machine
+MAX_CONCURRENT_JOBS = max(1, int(os.environ.get('MAX_CONCURRENT_JOBS', 2)))
+
+# Clip rendering pool: number of concurrent ffmpeg encodes and threads per encode. By default each job
+# gets its share of the cores, so concurrent jobs do not oversubscribe the CPU between them.
+THREADS_PER_CLIP = int(os.environ.get('THREADS_PER_CLIP', 2))
+CLIP_WORKERS = int(os.environ.get('CLIP_WORKERS', 0)) or max(1, (os.cpu_count() or 1) // (THREADS_PER_CLIP * MAX_CONCURRENT_JOBS))
+
+# Text-to-speech endpoint, overridable to point at a local stub server
+TTS_API_URL = os.environ.get('ELEVENLABS_API_URL', ELEVENLABS_API_URL)
+TTS_WORKERS = int(os.environ.get('TTS_WORKERS', 4))  # Concurrent requests in chunked mode
+# Connections to the TTS API are shared by all requests, enough to keep every chunk worker of every job alive
+TTS_SESSION = pooled_session(TTS_WORKERS * MAX_CONCURRENT_JOBS)
+
+# Subtitle burning service, overridable in the same way; its connections are shared by all requests
+SUBTITLE_SERVICE_URL = os.environ.get('SUBTITLE_SERVICE_URL', SUBTITLE_SERVICE_URL)
+SUBTITLE_CLIENT = SubtitleClient(SUBTITLE_SERVICE_URL, max_retries=int(os.environ.get('SUBTITLE_SERVICE_RETRIES', 3)))
+
+# How the source video's audio is extracted for the old timestamps alignment (see VideoToAudioConverter.MODES)
+AUDIO_EXTRACTION_MODE = os.environ.get('AUDIO_EXTRACTION_MODE', 'pcm16k')
+
+# Alignment backend: 'worker' keeps aeneas loaded in long-lived processes, 'subprocess' starts one per alignment
+ALIGNMENT_ENGINE = os.environ.get('ALIGNMENT_ENGINE', 'worker')
+ALIGNMENT_WORKER_POOL = AeneasWorkerPool(int(os.environ.get('ALIGNMENT_WORKER_PROCESSES', 2)),
+                                         timeout=float(os.environ.get('ALIGNMENT_WORKER_TIMEOUT', 900))) if ALIGNMENT_ENGINE == 'worker' else None
+
+# Persistent caches shared by all requests
+CACHE_DIR = Path(os.environ.get('MEDIA_CACHE_DIR', Path.home() / '.cache' / 'video_processing_backend'))
+TTS_CACHE = MediaCache(CACHE_DIR / 'tts', max_bytes=int(os.environ.get('TTS_CACHE_MAX_BYTES', 1024 ** 3)), name='tts')
+MUSIC_CACHE = MediaCache(CACHE_DIR / 'music', max_bytes=int(os.environ.get('MUSIC_CACHE_MAX_BYTES', 512 * 1024 ** 2)), name='music')
+CLIP_CACHE = MediaCache(CACHE_DIR / 'clips', max_bytes=int(os.environ.get('CLIP_CACHE_MAX_BYTES', 4 * 1024 ** 3)), name='clips')
+ALIGNMENT_CACHE = MediaCache(CACHE_DIR / 'alignment', max_bytes=int(os.environ.get('ALIGNMENT_CACHE_MAX_BYTES', 64 * 1024 ** 2)), name='alignment')
+
+# Background music files shipped with the app
+BGM_HAPPY_PATH = Path(os.environ.get('BGM_HAPPY_PATH', Path(__file__).parent / "happy.mp3"))
+BGM_SAD_PATH = Path(os.environ.get('BGM_SAD_PATH', Path(__file__).parent / "sad.mp3"))
+
+# Font for locally rendered subtitles; if the file is missing, fontconfig picks a similar font
+SUBTITLE_FONT_PATH = Path(os.environ.get('SUBTITLE_FONT_PATH', Path(__file__).parent / "Montserrat-Bold.ttf"))
+
+class Pipeline:
+    """
+    Runs the whole processing pipeline for one request: audio extraction, TTS, silence trimming,
+    alignment, video rendering and the final mix.
+
+    :param options: dict - Request options (voice, speed, music windows, subtitle styling, ...).
+    :param work_dir: Path - Directory holding the inputs; all intermediate and output files are written here.
+    :param progress: callable - Optional callback receiving (stage, fraction) as the pipeline advances.
+    :param job_id: str - Optional job ID, recorded in the timings manifest.
+    """
+    STAGES = ("extracting_audio", "generating_audio", "trimming_silence", "aligning_new", "aligning_old",
+              "preparing_music", "rendering_video", "adding_subtitles", "mixing_audio")
+    # Stages of each kind that may run at once: TTS and the subtitle service, audio processing in Python,
+    # and ffmpeg/aeneas processes
+    STAGE_WORKERS = {"network": 2, "cpu": 1, "subprocess": 3}
+
+    def __init__(self, options, work_dir, progress=None, job_id=None):
+        self.options = options
+        self.work_dir = Path(work_dir)
+        self.progress = progress
+        self.metrics = JobMetrics(job_id)
+        self.started_stages = 0
+
+    @staticmethod
+    def check_inputs(video_path):
+        """
+        Reject inputs the pipeline cannot process before any work is queued for them: the old timestamps
+        are aligned against the video's own audio, so a video without an audio track cannot be retimed.
+
+        :param video_path: Path - The source video.
+        """
+        if not VideoToAudioConverter().has_audio(video_path):
+            raise NoAudioTrack(f"The video has no audio track to align the script against: {Path(video_path).name}")
+
+    def report(self, stage):
+        logging.debug(f"Pipeline stage: {stage}")
+        if self.progress:
+            self.progress(stage, self.started_stages / len(self.STAGES))
+        self.started_stages += 1
+
+    def run(self, text_path, video_path, reuse_dir=None):
+        """
+        Process the saved inputs.
+
+        :param text_path: Path - The script (.txt).
+        :param video_path: Path - The source video.
+        :param reuse_dir: Path - Optional work directory of an earlier run of the same inputs (e.g. a preview)
+                                 whose narration and alignments are reused, so only the video is rendered again.
+        :return: list of Path - The new and old timestamp SRTs, the silence-removed audio, the final video and
+                 the timings manifest.
+        """
+        with self.metrics.activate():
+            output_paths = self.process(text_path, video_path, reuse_dir)
+        logging.debug(f"Pipeline finished in {self.metrics.total_seconds():.3f}s")
+        return output_paths + [self.metrics.write_manifest(self.work_dir / "timings.json")]
+
+    def reuse_artifacts(self, reuse_dir, paths):
+        """
+        Link the files of an earlier run into this run's work directory.
+
+        :param reuse_dir: Path - The earlier run's work directory.
+        :param paths: dict - Artifact name to its path in this run; the file is looked up by name in `reuse_dir`.
+        :return: dict - The reused artifacts.
+        """
+        reused = {}
+        for name, path in paths.items():
+            source = Path(reuse_dir) / path.name
+            if not source.is_file():
+                raise FileNotFoundError(f"The earlier run has no {name} to reuse: {source}")
+            reused[name] = link_or_copy(source, path)
+            # The alignment JSON keeps the exact timestamps of an SRT
+            if path.suffix == '.srt' and source.with_suffix('.json').is_file():
+                link_or_copy(source.with_suffix('.json'), path.with_suffix('.json'))
+        return reused
+
+    def process(self, text_path, video_path, reuse_dir=None):
+        """
+        Run the stages as a graph: every stage starts as soon as the files it needs exist, so the audio
+        extraction and old alignment run while the narration is generated, and the music bed is prepared
+        while the video renders.
+        """
+        options = self.options
+
+        # With fused narration processing, the speed-up and silence trimming happen in one decode/encode pass,
+        # and alignment and mixing read a lossless copy of the narration instead of the MP3
+        fused_narration = options.get('fused_narration', True)
+
+        # Create instances of AudioGenerator, SilenceRemover, and VideoToAudioConverter
+        audio_generator = AudioGenerator(options['api_key'], options['speed'], options['set_speed_up'] and not fused_narration,
+                                         cache=TTS_CACHE, api_url=TTS_API_URL, chunked=options['tts_chunked'], max_workers=TTS_WORKERS,
+                                         session=TTS_SESSION)
+        silence_remover = SilenceRemover()
+        video_to_audio_converter = VideoToAudioConverter()
+
+        # Define the output file paths
+        extracted_audio_path = video_path.with_suffix(VideoToAudioConverter.OUTPUT_SUFFIXES[AUDIO_EXTRACTION_MODE])
+        generated_audio_path = text_path.with_suffix('.gen.mp3')
+        trimmed_audio_path = text_path.with_suffix('.trimmed.mp3')
+        narration_path = text_path.with_suffix('.trimmed.wav') if fused_narration else trimmed_audio_path
+        new_timestamps_srt = text_path.with_stem(text_path.stem + '_new_timestamps').with_suffix('.srt')
+        old_timestamps_srt = text_path.with_stem(text_path.stem + '_old_timestamps').with_suffix('.srt')
+        final_video_path = self.work_dir / "final_video.mp4"
+
+        # Input pairs for RunAeneas: the silence-removed audio first, the audio extracted from the video second
+        input_pairs = [
+            (narration_path, text_path),
+            (extracted_audio_path, text_path)
+        ]
+
+        # The old timestamps only depend on the source video, so they are cached by the video's content
+        # and the audio extraction is skipped for videos that were aligned before
+        alignment_cache = None if options.get('bypass_alignment_cache') else ALIGNMENT_CACHE
+        run_aeneas = RunAeneas(
+            input_pairs,
+            worker_pool=ALIGNMENT_WORKER_POOL,
+            cache=alignment_cache,
+            fingerprints={1: f"video:{file_digest(video_path)}:extracted-{AUDIO_EXTRACTION_MODE}"} if alignment_cache else None
+        )
+
+        video_processor = VideoProcessor(
+            new_mp3_path=narration_path,
+            srt_path_new=new_timestamps_srt,
+            srt_path_old=old_timestamps_srt,
+            video_path=video_path,
+            bgm_happy_path=BGM_HAPPY_PATH,
+            bgm_sad_path=BGM_SAD_PATH,
+            happy_start=options['happy_start'],
+            happy_end=options['happy_end'],
+            sad_start=options['sad_start'],
+            sad_end=options['sad_end'],
+            bg_width=options['bg_width'],
+            bg_height=options['bg_height'],
+            font_size=options['font_size'],
+            bottom_padding=options['bottom_padding'],
+            max_width=options['max_width'],  # Pass max width to VideoProcessor
+            output_dir=self.work_dir,
+            max_workers=CLIP_WORKERS,
+            threads_per_clip=THREADS_PER_CLIP,
+            render_engine=options['render_engine'],
+            stream_copy=options.get('stream_copy', True),
+            encoding_profile=get_encoding_profile(options.get('encoding_profile')),
+            proxy_height=options.get('preview_height') if options.get('preview') else None,
+            music_cache=MUSIC_CACHE,
+            clip_cache=CLIP_CACHE,
+            subtitle_service_url=SUBTITLE_SERVICE_URL,
+            subtitle_client=SUBTITLE_CLIENT,
+            subtitle_mode=options.get('subtitle_mode', 'remote'),
+            font_path=SUBTITLE_FONT_PATH
+        )
+
+        def extract_audio(video):
+            # Convert the video to audio
+            video_to_audio_converter.extract_audio(video, extracted_audio_path, AUDIO_EXTRACTION_MODE)
+            logging.debug(f"Extracted audio path: {extracted_audio_path}")
+            return extracted_audio_path
+
+        def generate_audio(text):
+            # Generate the audio file from the text
+            audio_generator.generate_audio(text, generated_audio_path, options['voice_id'])
+            logging.debug(f"Generated audio path: {generated_audio_path}")
+            return generated_audio_path
+
+        def trim_silence(generated_audio):
+            # Trim silence from the generated audio file
+            if fused_narration:
+                speed = options['speed'] if options['set_speed_up'] else 1
+                NarrationProcessor(speed, silence_remover).process(generated_audio, trimmed_audio_path, narration_path)
+            else:
+                silence_remover.trim_silence(generated_audio, trimmed_audio_path)
+            logging.debug(f"Trimmed audio path: {trimmed_audio_path}")
+            return narration_path
+
+        def align_new(narration, text):
+            srt_file, _ = run_aeneas.process_pair(0, narration, text)
+            logging.debug(f"New timestamps SRT: {srt_file}")
+            return srt_file
+
+        def align_old(extracted_audio, text):
+            srt_file, _ = run_aeneas.process_pair(1, extracted_audio, text)
+            logging.debug(f"Old timestamps SRT: {srt_file}")
+            return srt_file
+
+        def mix_audio(subtitled_video, narration, music_bed):
+            video_processor.overlay_audio(subtitled_video, final_video_path, music_bed)
+            return final_video_path
+
+        stages = [
+            Stage("generating_audio", generate_audio, inputs=("text",), outputs=("generated_audio",), kind="network"),
+            Stage("trimming_silence", trim_silence, inputs=("generated_audio",), outputs=("narration",), kind="cpu"),
+            Stage("aligning_new", align_new, inputs=("narration", "text"), outputs=("new_srt",)),
+            Stage("preparing_music", video_processor.prepare_music_bed, outputs=("music_bed",)),
+            Stage("rendering_video", lambda new_srt, old_srt: video_processor.render_video(),
+                  inputs=("new_srt", "old_srt"), outputs=("rendered_video",)),
+            Stage("adding_subtitles", lambda rendered_video, new_srt: video_processor.add_subtitles(rendered_video),
+                  inputs=("rendered_video", "new_srt"), outputs=("subtitled_video",), kind="network"),
+            Stage("mixing_audio", mix_audio, inputs=("subtitled_video", "narration", "music_bed"), outputs=("final_video",)),
+        ]
+        artifacts = {"text": text_path, "video": video_path}
+        if reuse_dir is not None:
+            # Only the stages that depend on the render options run again; TTS and alignment are skipped
+            artifacts.update(self.reuse_artifacts(reuse_dir, {
+                "narration": narration_path,
+                "trimmed_audio": trimmed_audio_path,
+                "new_srt": new_timestamps_srt,
+                "old_srt": old_timestamps_srt,
+            }))
+
+        if "old_srt" in artifacts:
+            logging.debug("Old timestamps reused, skipping audio extraction")
+        elif run_aeneas.restore_from_cache(1):
+            logging.debug("Old timestamps restored from cache, skipping audio extraction")
+            artifacts["old_srt"] = run_aeneas.results[1][0]
+        else:
+            stages += [
+                Stage("extracting_audio", extract_audio, inputs=("video",), outputs=("extracted_audio",)),
+                Stage("aligning_old", align_old, inputs=("extracted_audio", "text"), outputs=("old_srt",)),
+            ]
+
+        executor = DagExecutor(stages, workers=self.STAGE_WORKERS, on_start=lambda stage: self.report(stage.name))
+        try:
+            artifacts = executor.run(artifacts, targets=("final_video",))
+        finally:
+            self.metrics.critical_path = executor.log_critical_path()
+        logging.debug(f"Music cache: {MUSIC_CACHE.stats()}")
+        logging.debug(f"Clip cache: {CLIP_CACHE.stats()}")
+
+        return [artifacts["new_srt"], artifacts["old_srt"], trimmed_audio_path, artifacts["final_video"]]
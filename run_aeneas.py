@@ -1,18 +1,30 @@
 import os
+import sys
 import subprocess
 import json
 import logging
+from aeneas_worker import AeneasWorkerUnavailable
+from utils import file_digest
+from metrics import run_process
+from timeline import Timeline
 
 class RunAeneas:
-    def __init__(self, input_pairs):
+    TASK_CONFIGURATION = "task_language=eng|is_text_type=plain|os_task_file_format=json"
+
+    def __init__(self, input_pairs, worker_pool=None, cache=None, fingerprints=None):
         self.input_pairs = input_pairs
+        self.worker_pool = worker_pool  # Optional AeneasWorkerPool with aeneas already loaded
+        self.cache = cache  # Optional CacheBackend for sync maps
+        # Pair index -> fingerprint of the audio, for pairs whose audio is identified by something other than its file
+        self.fingerprints = fingerprints or {}
+        self.results = {}  # Pair index -> (srt_file, srt_json_file) of pairs restored from the cache
         logging.basicConfig(level=logging.DEBUG)
         logging.debug(f"Initialized RunAeneas with input pairs: {self.input_pairs}")
 
     def generate_sync_map(self, mp3_file, txt_file, output_file_path):
-        command = f'python3 -m aeneas.tools.execute_task "{mp3_file}" "{txt_file}" "task_language=eng|is_text_type=plain|os_task_file_format=json" "{output_file_path}"'
-        logging.debug(f"Running command: {command}")
-        result = subprocess.run(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        command = [sys.executable, "-m", "aeneas.tools.execute_task", str(mp3_file), str(txt_file), self.TASK_CONFIGURATION, str(output_file_path)]
+        logging.debug(f"Running command: {' '.join(command)}")
+        result = run_process(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
 
         # Check the output and error of the command
         logging.debug("Command output: %s", result.stdout.decode('utf-8'))
@@ -23,61 +35,90 @@ class RunAeneas:
             raise FileNotFoundError(f"The output file {output_file_path} was not created. Check the command output above for errors.")
         logging.debug(f"Sync map generated successfully: {output_file_path}")
 
+    def align(self, mp3_file, txt_file, output_file_path):
+        """
+        Compute the sync map for a pair, using the worker pool when available.
+
+        The subprocess path is used when no pool is configured or the pool's worker died; only that
+        path writes the sync map to output_file_path.
+
+        :return: dict - The sync map.
+        """
+        if self.worker_pool is not None:
+            try:
+                return self.worker_pool.align(mp3_file, txt_file, self.TASK_CONFIGURATION)
+            except AeneasWorkerUnavailable as e:
+                logging.warning(f"Aeneas worker unavailable, falling back to a subprocess: {e}")
+        self.generate_sync_map(mp3_file, txt_file, output_file_path)
+        return self.read_output_file(output_file_path)
+
     def read_output_file(self, output_file_path):
         logging.debug(f"Reading output file: {output_file_path}")
         with open(output_file_path, 'r') as f:
             return json.load(f)
 
-    def convert_time(self, seconds):
-        milliseconds = int((seconds - int(seconds)) * 1000)
-        minutes, seconds = divmod(int(seconds), 60)
-        hours, minutes = divmod(minutes, 60)
-        return f"{hours:02}:{minutes:02}:{seconds:02},{milliseconds:03}"
-
     def process_output(self, sync_map, txt_file, srt_file_name):
         logging.debug(f"Processing sync map for: {txt_file}")
-        aligned_output = []
-        for index, fragment in enumerate(sync_map['fragments']):
-            start = self.convert_time(float(fragment['begin']))
-            end = self.convert_time(float(fragment['end']))
-            text = fragment['lines'][0].strip()
-            aligned_output.append(f"{index + 1}\n{start} --> {end}\n{text}\n")
+        timeline = Timeline.from_sync_map(sync_map)
 
         srt_file = txt_file.with_stem(txt_file.stem + f"_{srt_file_name}").with_suffix(".srt")
-        with open(srt_file, 'w') as file:
-            for line in aligned_output:
-                file.write(line + "\n")
+        timeline.write_srt(srt_file)
         logging.debug(f"SRT file created: {srt_file}")
 
-        srt_json = []
-        for index, fragment in enumerate(sync_map['fragments']):
-            start = float(fragment['begin'])
-            end = float(fragment['end'])
-            text = fragment['lines'][0].strip()
-            srt_json.append({
-                "index": index + 1,
-                "start": start,
-                "end": end,
-                "text": text
-            })
-
-        srt_json_file = srt_file.with_suffix(".json")
-        with open(srt_json_file, 'w') as file:
-            json.dump(srt_json, file, indent=4)
+        # The exact times, which Timeline.load prefers over the SRT's milliseconds
+        srt_json_file = timeline.write_json(srt_file.with_suffix(".json"))
         logging.debug(f"SRT JSON file created: {srt_json_file}")
 
         return srt_file, srt_json_file
 
-    def run(self):
-        for index, (mp3_file, txt_file) in enumerate(self.input_pairs):
-            logging.debug(f"Processing pair: MP3: {mp3_file}, TXT: {txt_file}")
-            if not os.path.isfile(mp3_file) or not os.path.isfile(txt_file):
-                raise ValueError(f"MP3 and TXT files are required: {mp3_file}, {txt_file}")
-
-            output_file_path = txt_file.with_stem(txt_file.stem + f"_aligned_{index}").with_suffix(".json")
-            logging.debug(f"Output file path: {output_file_path}")
-            self.generate_sync_map(mp3_file, txt_file, output_file_path)
-            sync_map = self.read_output_file(output_file_path)
-            srt_file_name = "new_timestamps" if index == 0 else "old_timestamps"
-            srt_file, srt_json_file = self.process_output(sync_map, txt_file, srt_file_name)
-            logging.debug(f"Output files created: {srt_file}, {srt_json_file}")
+    def output_file_path(self, index, txt_file):
+        return txt_file.with_stem(txt_file.stem + f"_aligned_{index}").with_suffix(".json")
+
+    def cache_key(self, index):
+        """
+        Build the sync map cache key of a pair from its audio fingerprint, transcript and task configuration.
+        """
+        mp3_file, txt_file = self.input_pairs[index]
+        fingerprint = self.fingerprints.get(index) or file_digest(mp3_file)
+        return self.cache.make_key("sync-map", fingerprint, file_digest(txt_file), self.TASK_CONFIGURATION)
+
+    def write_outputs(self, index, sync_map, txt_file):
+        srt_file_name = "new_timestamps" if index == 0 else "old_timestamps"
+        srt_file, srt_json_file = self.process_output(sync_map, txt_file, srt_file_name)
+        logging.debug(f"Output files created: {srt_file}, {srt_json_file}")
+        return srt_file, srt_json_file
+
+    def restore_from_cache(self, index):
+        """
+        Write the outputs of a pair from a cached sync map, without aligning it.
+
+        Pairs with a fingerprint can be restored before their audio file exists, so their inputs need not be made.
+
+        :param index: int - Index of the input pair.
+        :return: bool - True if the pair was restored from the cache.
+        """
+        mp3_file, txt_file = self.input_pairs[index]
+        if self.cache is None or (index not in self.fingerprints and not os.path.isfile(mp3_file)):
+            return False
+        output_file_path = self.output_file_path(index, txt_file)
+        if not self.cache.fetch(self.cache_key(index), output_file_path):
+            return False
+        logging.debug(f"Sync map restored from cache: {output_file_path}")
+        self.results[index] = self.write_outputs(index, self.read_output_file(output_file_path), txt_file)
+        return True
+
+    def process_pair(self, index, mp3_file, txt_file):
+        if self.restore_from_cache(index):
+            return self.results[index]
+
+        logging.debug(f"Processing pair: MP3: {mp3_file}, TXT: {txt_file}")
+        if not os.path.isfile(mp3_file) or not os.path.isfile(txt_file):
+            raise ValueError(f"MP3 and TXT files are required: {mp3_file}, {txt_file}")
+
+        output_file_path = self.output_file_path(index, txt_file)
+        logging.debug(f"Output file path: {output_file_path}")
+        sync_map = self.align(mp3_file, txt_file, output_file_path)
+        if self.cache is not None:
+            # The worker backend returns the sync map without writing it, so it is cached from memory
+            self.cache.store_bytes(self.cache_key(index), json.dumps(sync_map).encode('utf-8'))
+        return self.write_outputs(index, sync_map, txt_file)
@@ -1,29 +1,150 @@
+import numpy as np
 from pydub import AudioSegment
 from pydub.silence import detect_nonsilent
 
 class SilenceRemover:
-    def __init__(self, silence_threshold=-50.0, min_silence_len=500):
+    # "numpy" computes the window levels in bulk, "pydub" uses pydub.silence.detect_nonsilent
+    ENGINES = ("numpy", "pydub")
+
+    def __init__(self, silence_threshold=-50.0, min_silence_len=500, engine="numpy"):
+        if engine not in self.ENGINES:
+            raise ValueError(f"Unknown silence engine: {engine}. Expected one of {', '.join(self.ENGINES)}")
         self.silence_threshold = silence_threshold
         self.min_silence_len = min_silence_len
+        self.engine = engine
 
-    def trim_silence(self, audio_path, output_path):
+    @staticmethod
+    def ms_to_frame(audio, ms):
+        # Same rounding as pydub slicing: audio[start:end] uses int(ms * frame_rate / 1000)
+        return int(min(ms, len(audio)) * audio.frame_rate / 1000.0)
+
+    def window_levels(self, audio, block_ms=10000):
         """
-        Trim silence from an audio file.
+        Compute the RMS level of every `min_silence_len` window, starting at every millisecond.
 
-        :param audio_path: str - Path to the input audio file.
-        :param output_path: str - Path to save the trimmed audio file.
+        Energies are summed per millisecond block by block, so memory stays proportional to the block
+        size rather than to the length of the audio.
+
+        :param audio: AudioSegment - The audio to analyse.
+        :param block_ms: int - Milliseconds of audio processed at a time.
+        :return: numpy.ndarray - RMS of each window, matching pydub's AudioSegment.rms.
         """
-        # Load the audio file
-        audio = AudioSegment.from_file(audio_path)
+        length_ms = len(audio)
+        samples = np.asarray(audio.get_array_of_samples()).reshape(-1, audio.channels)
+        boundaries = (np.arange(length_ms + 1) * (audio.frame_rate / 1000.0)).astype(np.int64)
+
+        energy_per_ms = np.empty(length_ms, dtype=np.float64)
+        for block_start in range(0, length_ms, block_ms):
+            block_end = min(block_start + block_ms, length_ms)
+            first_frame = boundaries[block_start]
+            last_frame = boundaries[block_end]
+            block = samples[first_frame:last_frame].astype(np.float64)
+            energy = np.square(block).sum(axis=1)
+            # pydub pads slices that run past the end with silent frames
+            if len(energy) < last_frame - first_frame:
+                energy = np.concatenate([energy, np.zeros(last_frame - first_frame - len(energy))])
+            energy_per_ms[block_start:block_end] = np.add.reduceat(energy, boundaries[block_start:block_end] - first_frame)
+
+        cumulative_energy = np.concatenate([[0.0], np.cumsum(energy_per_ms)])
+        window_starts = np.arange(length_ms - self.min_silence_len + 1)
+        window_ends = window_starts + self.min_silence_len
+        window_energy = cumulative_energy[window_ends] - cumulative_energy[window_starts]
+        window_samples = (boundaries[window_ends] - boundaries[window_starts]) * audio.channels
+        # audioop.rms truncates to an integer
+        return np.floor(np.sqrt(window_energy / window_samples))
+
+    def detect_nonsilent_numpy(self, audio):
+        """
+        Vectorized equivalent of pydub's detect_nonsilent with a seek step of 1 ms.
+
+        :param audio: AudioSegment - The audio to analyse.
+        :return: list of [start, end] - Non-silent ranges in milliseconds.
+        """
+        length_ms = len(audio)
+        if length_ms < self.min_silence_len:
+            return [[0, length_ms]]
+
+        threshold = (10 ** (self.silence_threshold / 20.0)) * audio.max_possible_amplitude
+        silence_starts = np.flatnonzero(self.window_levels(audio) <= threshold)
+        if len(silence_starts) == 0:
+            return [[0, length_ms]]
+
+        # Windows that start within min_silence_len of each other overlap and form one silent range
+        breaks = np.flatnonzero(np.diff(silence_starts) > self.min_silence_len)
+        range_starts = silence_starts[np.concatenate([[0], breaks + 1])]
+        range_ends = silence_starts[np.concatenate([breaks, [len(silence_starts) - 1]])] + self.min_silence_len
+
+        if range_starts[0] == 0 and range_ends[0] == length_ms:
+            return []
+
+        nonsilent_ranges = [[int(start), int(end)] for start, end in zip(np.concatenate([[0], range_ends]), range_starts)]
+        if range_ends[-1] != length_ms:
+            nonsilent_ranges.append([int(range_ends[-1]), length_ms])
+        if nonsilent_ranges[0] == [0, 0]:
+            nonsilent_ranges.pop(0)
+        return nonsilent_ranges
+
+    def nonsilent_ranges(self, audio):
+        """
+        Detect the non-silent ranges of the audio with the configured engine.
 
+        :param audio: AudioSegment - The audio to analyse.
+        :return: list of [start, end] - Non-silent ranges in milliseconds.
+        """
+        if self.engine == "numpy":
+            return self.detect_nonsilent_numpy(audio)
+        return detect_nonsilent(audio, min_silence_len=self.min_silence_len, silence_thresh=self.silence_threshold)
+
+    def gather(self, audio, ranges):
+        """
+        Join the given ranges of the audio into a single preallocated buffer.
+
+        :param audio: AudioSegment - The source audio.
+        :param ranges: list of [start, end] - Ranges to keep, in milliseconds.
+        :return: AudioSegment - The joined audio.
+        """
+        samples = np.asarray(audio.get_array_of_samples()).reshape(-1, audio.channels)
+        spans = [(self.ms_to_frame(audio, start), self.ms_to_frame(audio, end)) for start, end in ranges]
+        output = np.zeros((sum(end - start for start, end in spans), audio.channels), dtype=samples.dtype)
+        position = 0
+        for start, end in spans:
+            # Frames past the end of the audio stay silent, as in pydub slicing
+            available = samples[start:end]
+            output[position:position + len(available)] = available
+            position += end - start
+        return audio._spawn(output.tobytes())
+
+    def trim_segment(self, audio):
+        """
+        Remove the silent ranges from an already decoded audio segment.
+
+        :param audio: AudioSegment - The audio to trim.
+        :return: AudioSegment - The trimmed audio.
+        """
         # Detect non-silent chunks
-        non_silent_chunks = detect_nonsilent(audio, min_silence_len=self.min_silence_len, silence_thresh=self.silence_threshold)
+        non_silent_chunks = self.nonsilent_ranges(audio)
+
+        if self.engine == "numpy":
+            return self.gather(audio, non_silent_chunks)
 
         # Combine non-silent chunks
         trimmed_audio = AudioSegment.empty()
         for start, end in non_silent_chunks:
             trimmed_audio += audio[start:end]
+        return trimmed_audio
+
+    def trim_silence(self, audio_path, output_path):
+        """
+        Trim silence from an audio file.
+
+        :param audio_path: str - Path to the input audio file.
+        :param output_path: str - Path to save the trimmed audio file.
+        """
+        # Load the audio file
+        audio = AudioSegment.from_file(audio_path)
+
+        trimmed_audio = self.trim_segment(audio)
 
         # Export the trimmed audio
         trimmed_audio.export(output_path, format="mp3")
-        print(f"Trimmed audio saved to: {output_path}")
\ No newline at end of file
+        print(f"Trimmed audio saved to: {output_path}")
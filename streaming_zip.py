@@ -0,0 +1,57 @@
+import io
+import zipfile
+from pathlib import Path
+
+# Media that is already compressed gains nothing from deflate, so it is stored as-is
+STORED_SUFFIXES = {'.mp4', '.mov', '.mkv', '.webm', '.mp3', '.m4a', '.aac', '.flac', '.ogg', '.zip', '.jpg', '.png'}
+
+class _StreamBuffer(io.RawIOBase):
+    """
+    Write-only, non-seekable file object that collects whatever zipfile writes until it is drained.
+    """
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+def iter_zip(paths, chunk_size=1024 * 1024, arcnames=None):
+    """
+    Generate a zip archive of the given files on the fly, without writing the archive anywhere.
+
+    Entries are written with data descriptors, so the archive can be streamed as it is produced.
+    Already-compressed media is stored, everything else is deflated.
+
+    :param paths: list of Path - Files to archive, stored under their file names.
+    :param chunk_size: int - Number of bytes read from each file at a time.
+    :param arcnames: list of str - Optional names to store the files under instead, in the same order.
+    :return: generator of bytes - The archive contents.
+    """
+    buffer = _StreamBuffer()
+    with zipfile.ZipFile(buffer, 'w') as zf:
+        for path, arcname in zip(paths, arcnames or [None] * len(paths)):
+            path = Path(path)
+            zinfo = zipfile.ZipInfo.from_file(path, arcname=arcname or path.name)
+            zinfo.compress_type = zipfile.ZIP_STORED if path.suffix.lower() in STORED_SUFFIXES else zipfile.ZIP_DEFLATED
+            with open(path, 'rb') as source, zf.open(zinfo, 'w') as entry:
+                for chunk in iter(lambda: source.read(chunk_size), b''):
+                    entry.write(chunk)
+                    data = buffer.drain()
+                    if data:
+                        yield data
+            yield buffer.drain()
+    yield buffer.drain()
@@ -0,0 +1,166 @@
+import os
+import time
+import uuid
+import logging
+import requests
+from pathlib import Path
+from metrics import record_transfer
+from http_retry import RETRY_STATUS_CODES, pooled_session, wait_before_retry
+
+class SubtitleServiceError(Exception):
+    """
+    Raised when the subtitle service does not return a video.
+    """
+
+class MultipartStream:
+    """
+    A multipart/form-data request body that is read from the files on disk as it is sent, instead of
+    being assembled in memory. Its length is known up front, so the request is sent with a Content-Length.
+
+    :param fields: dict - Plain form fields.
+    :param files: dict - Form field name to the path of the file to send.
+    """
+    def __init__(self, fields, files):
+        self.boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={self.boundary}"
+        self.segments = []
+        for name, value in fields.items():
+            self.segments.append(self.part_header(name) + f"{value}\r\n".encode())
+        for name, path in files.items():
+            path = Path(path)
+            self.segments.append(self.part_header(name, path.name))
+            self.segments.append(path)
+            self.segments.append(b"\r\n")
+        self.segments.append(f"--{self.boundary}--\r\n".encode())
+        self.length = sum(os.path.getsize(segment) if isinstance(segment, Path) else len(segment) for segment in self.segments)
+        self.bytes_read = 0
+        self.finished_at = None
+        self._current = None
+        self._index = 0
+
+    def part_header(self, name, filename=None):
+        disposition = f'form-data; name="{name}"' + (f'; filename="{filename}"' if filename else "")
+        content_type = "Content-Type: application/octet-stream\r\n" if filename else ""
+        return f"--{self.boundary}\r\nContent-Disposition: {disposition}\r\n{content_type}\r\n".encode()
+
+    def __len__(self):
+        return self.length
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.length
+        chunks = []
+        while size > 0 and self._index < len(self.segments):
+            segment = self.segments[self._index]
+            if isinstance(segment, Path):
+                if self._current is None:
+                    self._current = open(segment, "rb")
+                chunk = self._current.read(size)
+                if not chunk:
+                    self._current.close()
+                    self._current = None
+                    self._index += 1
+                    continue
+            else:
+                chunk = segment
+                self._index += 1
+            chunks.append(chunk)
+            size -= len(chunk)
+        data = b"".join(chunks)
+        self.bytes_read += len(data)
+        if self._index == len(self.segments) and self.finished_at is None:
+            self.finished_at = time.perf_counter()
+        return data
+
+    def close(self):
+        if self._current is not None:
+            self._current.close()
+            self._current = None
+
+class SubtitleClient:
+    """
+    Client for the remote subtitle service.
+
+    Connections are pooled in a session shared by all requests. The video is streamed to the service from
+    disk and the result streamed back to disk, so neither is held in memory. Failed attempts are retried
+    with exponential backoff and jitter, and every attempt reopens the input files.
+
+    :param url: str - The add_subtitles endpoint.
+    :param max_retries: int - Retries after the first attempt.
+    :param timeout: tuple - Connect and read timeouts in seconds; the service only responds once it has
+                            rendered the whole video.
+    :param pool_size: int - Connections kept alive, roughly the number of concurrent jobs.
+    """
+    def __init__(self, url, max_retries=3, timeout=(10, 6000), pool_size=4, chunk_size=1024 * 1024):
+        self.url = url
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.session = pooled_session(pool_size)
+
+    def post_once(self, fields, files, output_path):
+        """
+        Make one request, streaming the result to `output_path`.
+
+        :return: requests.Response - The response if it was not successful; None after a successful download.
+        """
+        body = MultipartStream(fields, files)
+        started_at = time.perf_counter()
+        try:
+            response = self.session.post(self.url, data=body, headers={"Content-Type": body.content_type},
+                                         timeout=self.timeout, stream=True)
+        finally:
+            body.close()
+        upload_seconds = (body.finished_at or time.perf_counter()) - started_at
+
+        with response:
+            if response.status_code != 200:
+                record_transfer(bytes_uploaded=body.bytes_read, upload_seconds=upload_seconds)
+                return response
+
+            partial_path = Path(output_path).with_name(Path(output_path).name + ".part")
+            downloaded = 0
+            download_started_at = time.perf_counter()
+            try:
+                with open(partial_path, "wb") as f:
+                    for chunk in response.iter_content(chunk_size=self.chunk_size):
+                        f.write(chunk)
+                        downloaded += len(chunk)
+            except BaseException:
+                partial_path.unlink(missing_ok=True)
+                raise
+            os.replace(partial_path, output_path)
+            download_seconds = time.perf_counter() - download_started_at
+
+        record_transfer(bytes_uploaded=body.bytes_read, upload_seconds=upload_seconds,
+                        bytes_downloaded=downloaded, download_seconds=download_seconds)
+        logging.debug(f"Subtitle service: sent {body.bytes_read / 1e6:.1f} MB in {upload_seconds:.2f}s, "
+                      f"received {downloaded / 1e6:.1f} MB in {download_seconds:.2f}s")
+        return None
+
+    def add_subtitles(self, video_path, srt_path, output_path, **fields):
+        """
+        Have the service burn the subtitles into the video.
+
+        :param video_path: Path - The video.
+        :param srt_path: Path - The subtitles.
+        :param output_path: Path - Where to write the video with subtitles.
+        :param fields: Styling fields sent along (font_size, bg_width, ...).
+        :return: Path - `output_path`.
+        """
+        files = {"video": video_path, "srt": srt_path}
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self.post_once(fields, files, output_path)
+            except requests.exceptions.RequestException as e:
+                if attempt == self.max_retries:
+                    raise SubtitleServiceError(f"Error contacting subtitle service: {e}") from e
+                logging.error(f"Error contacting subtitle service: {e}")
+            else:
+                if response is None:
+                    return Path(output_path)
+                logging.error(f"Failed to receive processed video. Status code: {response.status_code}")
+                if response.status_code not in RETRY_STATUS_CODES or attempt == self.max_retries:
+                    raise SubtitleServiceError(f"Subtitle service failed with status code {response.status_code}")
+
+            wait_before_retry(attempt, self.max_retries)
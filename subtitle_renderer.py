@@ -0,0 +1,88 @@
+import os
+import textwrap
+from pathlib import Path
+
+def escape_filter_value(value):
+    """
+    Escape a value for use as a filter option inside a filtergraph: once for the option parser and once
+    for the graph parser.
+    """
+    value = str(value).replace("\\", "\\\\").replace("'", "\\'").replace(":", "\\:")
+    for character in "\\'[],;":
+        value = value.replace(character, "\\" + character)
+    return value
+
+class SubtitleRenderer:
+    """
+    Burn subtitles into a video with ffmpeg's drawbox and drawtext filters, in the style of the remote
+    subtitle service: every fragment is shown centred in a box of `bg_width` x `bg_height` pixels, placed
+    `bottom_padding` pixels above the bottom of the frame, and wrapped to `max_width` pixels.
+
+    The renderer only builds a filter chain, so the subtitles can be drawn as part of an encode that
+    happens anyway instead of in a separate pass over the whole video.
+
+    :param font_path: Path - Font file; if it does not exist, fontconfig picks a font for `font_family`.
+    :param font_size: int - Font size in pixels.
+    :param bg_width: int - Width of the background box.
+    :param bg_height: int - Height of the background box.
+    :param bottom_padding: int - Distance between the box and the bottom of the frame.
+    :param max_width: int - Maximum width of a line of text before wrapping.
+    """
+    AVERAGE_CHARACTER_WIDTH = 0.6  # Average glyph width of a bold sans font, relative to the font size
+    BOX_COLOR = "black@0.6"
+    FONT_COLOR = "white"
+
+    def __init__(self, font_path, font_size, bg_width, bg_height, bottom_padding, max_width, font_family="Montserrat:style=Bold"):
+        self.font_path = Path(font_path) if font_path else None
+        self.font_family = font_family
+        self.font_size = font_size
+        self.bg_width = bg_width
+        self.bg_height = bg_height
+        self.bottom_padding = bottom_padding
+        self.max_width = max_width
+
+    def wrap(self, text):
+        """
+        Break the text into lines that fit `max_width`, estimating the width of the text from the font size.
+
+        :param text: str - The fragment text.
+        :return: str - The text with line breaks.
+        """
+        characters_per_line = max(1, int(self.max_width / (self.font_size * self.AVERAGE_CHARACTER_WIDTH)))
+        return "\n".join(textwrap.wrap(text, width=characters_per_line)) or " "
+
+    def font_option(self):
+        if self.font_path and self.font_path.exists():
+            return f"fontfile={escape_filter_value(self.font_path.resolve())}"
+        return f"font={escape_filter_value(self.font_family)}"
+
+    def build_filter(self, cues, text_dir):
+        """
+        Build the filter chain that draws every cue, writing the text of each cue to a file in `text_dir`.
+
+        Text is read from files rather than inlined, so it needs no escaping.
+
+        :param cues: list of tuples - (start seconds, end seconds, text) for every fragment.
+        :param text_dir: Path - Directory for the text files; created if missing.
+        :return: str - Comma-separated filters, to be applied to a single video stream.
+        """
+        text_dir = Path(text_dir)
+        os.makedirs(text_dir, exist_ok=True)
+        box_y = f"ih-{self.bg_height}-{self.bottom_padding}"
+        filters = []
+        for i, (start, end, text) in enumerate(cues):
+            text_path = text_dir / f"subtitle_{i}.txt"
+            with open(text_path, "w", encoding="utf-8") as file:
+                file.write(self.wrap(text))
+            enable = escape_filter_value(f"between(t,{start:.3f},{end:.3f})")
+            filters.append(
+                f"drawbox=x=(iw-{self.bg_width})/2:y={box_y}:w={self.bg_width}:h={self.bg_height}"
+                f":color={self.BOX_COLOR}:t=fill:enable={enable}"
+            )
+            filters.append(
+                f"drawtext={self.font_option()}:textfile={escape_filter_value(text_path.resolve())}:expansion=none"
+                f":fontsize={self.font_size}:fontcolor={self.FONT_COLOR}"
+                f":x=(w-text_w)/2:y=h-{self.bg_height}-{self.bottom_padding}+({self.bg_height}-text_h)/2"
+                f":enable={enable}"
+            )
+        return ",".join(filters) or "null"
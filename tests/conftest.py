@@ -0,0 +1,54 @@
+import sys
+import types
+from http.server import BaseHTTPRequestHandler
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import http_retry
+
+@pytest.fixture
+def scripted_handler():
+    """
+    Factory for stub server handlers that answer successive POSTs with scripted responses.
+    """
+    return make_scripted_handler
+
+def make_scripted_handler(responses):
+    """
+    Build a stub server handler that answers successive POSTs with `responses` in turn, repeating the
+    last one. Request paths are recorded in the handler's `requests` list.
+
+    :param responses: list of tuples - (status, headers, body); a body shorter than a Content-Length
+                                       header simulates a connection dropped mid-download.
+    """
+    class ScriptedHandler(BaseHTTPRequestHandler):
+        requests = []
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers["Content-Length"]))
+            self.requests.append(self.path)
+            status, headers, body = responses[min(len(self.requests), len(responses)) - 1]
+            self.send_response(status)
+            headers = {"Content-Length": str(len(body)), **headers}
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+            self.close_connection = len(body) != int(headers["Content-Length"])
+
+        def log_message(self, format, *args):
+            pass
+
+    return ScriptedHandler
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """
+    Record the delays the HTTP clients wait between retries instead of sleeping.
+    """
+    delays = []
+    monkeypatch.setattr(http_retry, "time", types.SimpleNamespace(sleep=delays.append))
+    return delays
@@ -0,0 +1,57 @@
+import pytest
+
+from audio_generator import AudioGenerator
+from benchmark import stub_server
+from media_cache import MediaCache
+
+AUDIO = b"ID3" + bytes(range(256)) * 8
+
+def make_generator(url, **kwargs):
+    return AudioGenerator("key", set_speed_up=False, api_url=url, **kwargs)
+
+def test_retry_after_header_sets_the_delay(tmp_path, sleeps, scripted_handler):
+    handler = scripted_handler([(429, {"Retry-After": "3"}, b"slow down"), (200, {}, AUDIO)])
+    with stub_server(handler) as url:
+        make_generator(url).request_audio("Hello.", tmp_path / "out.mp3", "voice")
+
+    assert (tmp_path / "out.mp3").read_bytes() == AUDIO
+    assert handler.requests == ["/v1/text-to-speech/voice"] * 2
+    assert sleeps == [3.0]
+
+def test_backoff_grows_without_retry_after(tmp_path, sleeps, scripted_handler):
+    handler = scripted_handler([(503, {}, b""), (503, {}, b""), (200, {}, AUDIO)])
+    with stub_server(handler) as url:
+        make_generator(url).request_audio("Hello.", tmp_path / "out.mp3", "voice")
+
+    assert len(handler.requests) == 3
+    assert 1 <= sleeps[0] < 2 and 2 <= sleeps[1] < 3
+
+def test_gives_up_after_max_retries(tmp_path, sleeps, scripted_handler):
+    handler = scripted_handler([(500, {}, b"down")])
+    with stub_server(handler) as url, pytest.raises(Exception, match="status code 500"):
+        make_generator(url, max_retries=2).request_audio("Hello.", tmp_path / "out.mp3", "voice")
+
+    assert len(handler.requests) == 3
+    assert len(sleeps) == 2
+
+def test_client_errors_are_not_retried(tmp_path, sleeps, scripted_handler):
+    handler = scripted_handler([(401, {}, b"bad key")])
+    with stub_server(handler) as url, pytest.raises(Exception, match="status code 401"):
+        make_generator(url).request_audio("Hello.", tmp_path / "out.mp3", "voice")
+
+    assert len(handler.requests) == 1
+    assert sleeps == []
+
+def test_cached_audio_skips_the_api(tmp_path, scripted_handler):
+    text_path = tmp_path / "script.txt"
+    text_path.write_text("Hello there. General Kenobi.")
+    handler = scripted_handler([(200, {}, AUDIO)])
+    cache = MediaCache(tmp_path / "cache")
+    with stub_server(handler) as url:
+        generator = make_generator(url, cache=cache)
+        generator.generate_audio(text_path, tmp_path / "first.mp3", "voice")
+        generator.generate_audio(text_path, tmp_path / "second.mp3", "voice")
+
+    assert len(handler.requests) == 1
+    assert (tmp_path / "second.mp3").read_bytes() == AUDIO
+    assert cache.stats()["hits"] == 1
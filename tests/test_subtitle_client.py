@@ -0,0 +1,49 @@
+import pytest
+
+from benchmark import StubSubtitleService, stub_server
+from subtitle_client import SubtitleClient, SubtitleServiceError
+
+VIDEO = bytes(range(256)) * 64
+
+@pytest.fixture
+def inputs(tmp_path):
+    video_path = tmp_path / "video.mp4"
+    video_path.write_bytes(VIDEO)
+    srt_path = tmp_path / "subtitles.srt"
+    srt_path.write_text("1\n00:00:00,000 --> 00:00:01,000\nHello\n")
+    return video_path, srt_path
+
+def test_result_is_streamed_to_the_output(tmp_path, inputs):
+    output_path = tmp_path / "out.mp4"
+    with stub_server(StubSubtitleService) as url:
+        result = SubtitleClient(url).add_subtitles(*inputs, output_path, font_size=35)
+
+    assert result == output_path
+    assert output_path.read_bytes() == VIDEO
+    assert not (tmp_path / "out.mp4.part").exists()
+
+def test_unavailable_service_is_retried(tmp_path, inputs, sleeps, scripted_handler):
+    handler = scripted_handler([(503, {}, b"busy"), (200, {}, VIDEO)])
+    with stub_server(handler) as url:
+        SubtitleClient(url).add_subtitles(*inputs, tmp_path / "out.mp4")
+
+    assert len(handler.requests) == 2
+    assert len(sleeps) == 1
+    assert (tmp_path / "out.mp4").read_bytes() == VIDEO
+
+def test_client_errors_are_not_retried(tmp_path, inputs, sleeps, scripted_handler):
+    handler = scripted_handler([(400, {}, b"bad request")])
+    with stub_server(handler) as url, pytest.raises(SubtitleServiceError, match="400"):
+        SubtitleClient(url).add_subtitles(*inputs, tmp_path / "out.mp4")
+
+    assert len(handler.requests) == 1
+    assert sleeps == []
+
+def test_interrupted_download_leaves_no_partial_file(tmp_path, inputs, sleeps, scripted_handler):
+    handler = scripted_handler([(200, {"Content-Length": str(len(VIDEO))}, VIDEO[:1000])])
+    with stub_server(handler) as url, pytest.raises(SubtitleServiceError):
+        SubtitleClient(url, max_retries=1).add_subtitles(*inputs, tmp_path / "out.mp4")
+
+    assert len(handler.requests) == 2
+    assert not (tmp_path / "out.mp4").exists()
+    assert not (tmp_path / "out.mp4.part").exists()
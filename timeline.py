@@ -0,0 +1,164 @@
+import re
+import json
+import numpy as np
+from pathlib import Path
+
+SRT_TIME_PATTERN = re.compile(r'(\d{2}):(\d{2}):(\d{2}),(\d{3}) --> (\d{2}):(\d{2}):(\d{2}),(\d{3})')
+
+def format_srt_times(seconds):
+    """
+    Format an array of times in seconds as SRT timestamps (HH:MM:SS,mmm), rounded to the millisecond.
+
+    :param seconds: numpy.ndarray - Times in seconds.
+    :return: list of str - The timestamps.
+    """
+    milliseconds = np.round(np.asarray(seconds, dtype=np.float64) * 1000).astype(np.int64)
+    hours, milliseconds = np.divmod(milliseconds, 3600000)
+    minutes, milliseconds = np.divmod(milliseconds, 60000)
+    secs, milliseconds = np.divmod(milliseconds, 1000)
+    return [f"{h:02}:{m:02}:{s:02},{ms:03}" for h, m, s, ms in zip(hours, minutes, secs, milliseconds)]
+
+class Timeline:
+    """
+    Timed text fragments, stored as arrays of start and end times in seconds.
+
+    Alignment results are loaded without going through SRT strings, so no precision is lost, and
+    comparisons between timelines are computed for all fragments at once. SRT text is only produced
+    when a timeline is written out.
+
+    :param starts: array-like - Start time of every fragment in seconds.
+    :param ends: array-like - End time of every fragment in seconds.
+    :param texts: list of str - Text of every fragment.
+    """
+    def __init__(self, starts, ends, texts):
+        self.starts = np.asarray(starts, dtype=np.float64)
+        self.ends = np.asarray(ends, dtype=np.float64)
+        self.texts = list(texts)
+        if not (len(self.starts) == len(self.ends) == len(self.texts)):
+            raise ValueError("Every fragment needs a start, an end and a text.")
+
+    def __len__(self):
+        return len(self.texts)
+
+    @property
+    def durations(self):
+        return self.ends - self.starts
+
+    @classmethod
+    def from_sync_map(cls, sync_map):
+        """
+        Build a timeline from an aeneas sync map.
+        """
+        fragments = sync_map['fragments']
+        return cls(
+            [float(fragment['begin']) for fragment in fragments],
+            [float(fragment['end']) for fragment in fragments],
+            [fragment['lines'][0].strip() for fragment in fragments]
+        )
+
+    @classmethod
+    def from_json(cls, json_path):
+        """
+        Read a timeline written by `write_json` (the JSON RunAeneas writes next to every SRT).
+        """
+        with open(json_path, 'r') as f:
+            fragments = json.load(f)
+        return cls(
+            [fragment['start'] for fragment in fragments],
+            [fragment['end'] for fragment in fragments],
+            [fragment['text'] for fragment in fragments]
+        )
+
+    @classmethod
+    def from_srt(cls, srt_path):
+        """
+        Parse an SRT file. Times are only as precise as the SRT's milliseconds.
+        """
+        starts, ends, texts = [], [], []
+        with open(srt_path, 'r', encoding='utf-8') as file:
+            for line in file:
+                line = line.strip()
+                match = SRT_TIME_PATTERN.search(line)
+                if match:
+                    h1, m1, s1, ms1, h2, m2, s2, ms2 = (int(value) for value in match.groups())
+                    starts.append(h1 * 3600 + m1 * 60 + s1 + ms1 / 1000)
+                    ends.append(h2 * 3600 + m2 * 60 + s2 + ms2 / 1000)
+                    texts.append("")
+                elif line and not line.isdigit() and texts:
+                    texts[-1] = f"{texts[-1]} {line}" if texts[-1] else line
+        return cls(starts, ends, texts)
+
+    @classmethod
+    def load(cls, srt_path):
+        """
+        Load the timeline of an SRT file, from the JSON next to it if there is one.
+
+        :param srt_path: Path - The SRT file.
+        :return: Timeline - The timeline.
+        """
+        json_path = Path(srt_path).with_suffix(".json")
+        if json_path.is_file():
+            return cls.from_json(json_path)
+        return cls.from_srt(srt_path)
+
+    def diffs(self, other, tolerance=1e-6):
+        """
+        How much longer every fragment of `other` is than the same fragment of this timeline.
+
+        :param other: Timeline - A timeline with the same fragments.
+        :param tolerance: float - Differences smaller than this are treated as zero.
+        :return: numpy.ndarray - Duration differences in seconds.
+        """
+        if len(self) != len(other):
+            raise ValueError("The number of old and new timestamps must be the same.")
+        time_diffs = other.durations - self.durations
+        time_diffs[np.abs(time_diffs) < tolerance] = 0
+        return time_diffs
+
+    def refine(self, time_diffs):
+        """
+        Shorten the fragments that take less time in the new timeline, so that they end with the new fragment.
+
+        :param time_diffs: numpy.ndarray - Duration differences from `diffs`.
+        :return: Timeline - The refined timeline.
+        """
+        return Timeline(self.starts, self.ends + np.minimum(time_diffs, 0), self.texts)
+
+    def speed_factors(self, time_diffs, threshold):
+        """
+        Playback speeds for fragments that have to be stretched to fit the new timeline.
+
+        :param time_diffs: numpy.ndarray - Duration differences from `diffs`.
+        :param threshold: float - Fragments needing this much extra time or less keep their speed.
+        :return: numpy.ndarray - Speed factor below 1.0 per fragment, NaN where the speed is kept.
+        """
+        durations = self.durations
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(time_diffs > threshold, durations / (durations + time_diffs), np.nan)
+
+    def cues(self):
+        """
+        :return: list of tuples - (start seconds, end seconds, text) per fragment.
+        """
+        return list(zip(self.starts.tolist(), self.ends.tolist(), self.texts))
+
+    def srt_entries(self):
+        """
+        :return: list of tuples - (start, end, text) per fragment, with the times formatted as in SRT.
+        """
+        return list(zip(format_srt_times(self.starts), format_srt_times(self.ends), self.texts))
+
+    def write_srt(self, srt_path):
+        with open(srt_path, 'w') as file:
+            for index, (start, end, text) in enumerate(self.srt_entries()):
+                file.write(f"{index + 1}\n{start} --> {end}\n{text}\n\n")
+        return srt_path
+
+    def write_json(self, json_path):
+        fragments = [
+            {"index": index + 1, "start": start, "end": end, "text": text}
+            for index, (start, end, text) in enumerate(self.cues())
+        ]
+        with open(json_path, 'w') as file:
+            json.dump(fragments, file, indent=4)
+        return json_path
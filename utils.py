@@ -1,6 +1,185 @@
+import os
+import shutil
+import hashlib
+import tempfile
+import threading
 from pathlib import Path
+from werkzeug.utils import secure_filename
 
-def save_uploaded_file(uploaded_file, destination: Path):
-    with destination.open('wb') as f:
-        f.write(uploaded_file.read())
+class UploadTooLarge(Exception):
+    """
+    Raised when an uploaded file exceeds the configured size limit.
+    """
 
+class InvalidUpload(Exception):
+    """
+    Raised when an uploaded file is missing or its name cannot be used.
+    """
+
+# Inputs are saved under fixed names, so client supplied names never become paths
+TEXT_INPUT_NAME = "script.txt"
+VIDEO_INPUT_STEM = "video"
+
+def video_input_name(filename):
+    """
+    The name a source video is saved under: a fixed stem with the extension of the client's file name.
+
+    :param filename: str - The file name sent by the client.
+    :return: str - The name to save the video as.
+    """
+    safe_name = secure_filename(filename or "")
+    # Names with directory parts are refused rather than silently reduced to their last part
+    if not safe_name or Path(filename).name != filename or "\\" in filename:
+        raise InvalidUpload(f"Unsafe or empty video file name: {filename!r}")
+    return VIDEO_INPUT_STEM + Path(safe_name).suffix.lower()
+
+def download_stem(filename):
+    """
+    The stem of the client's text file name, made safe. Outputs named after the saved text input are
+    offered for download under this stem, so clients get the names they got before inputs were renamed.
+
+    :param filename: str - The text file name sent by the client.
+    :return: str or None - The stem, or None if nothing usable is left of the name.
+    """
+    return Path(secure_filename(filename or "")).stem or None
+
+def download_name(path, stem=None):
+    """
+    The name an output file is offered for download under.
+
+    :param path: Path - The output file.
+    :param stem: str - Stem from download_stem, replacing the stem of TEXT_INPUT_NAME at the start of the name.
+    :return: str - The download name.
+    """
+    name = Path(path).name
+    input_stem = Path(TEXT_INPUT_NAME).stem
+    if stem and name.startswith((input_stem + "_", input_stem + ".")):
+        return stem + name[len(input_stem):]
+    return name
+
+# Memoized content digests, keyed by (resolved path, size, mtime_ns)
+_digests = {}
+_digests_lock = threading.Lock()
+
+def _digest_key(path):
+    stat = os.stat(path)
+    return str(Path(path).resolve()), stat.st_size, stat.st_mtime_ns
+
+def remember_file_digest(path, digest: str):
+    """
+    Record the digest of a file whose contents were hashed elsewhere (e.g. while it was being written).
+    """
+    with _digests_lock:
+        _digests[_digest_key(path)] = digest
+
+class UploadSpool:
+    """
+    File werkzeug writes an uploaded file part into while it parses the request (see Request._get_file_stream).
+
+    The part is hashed and checked against the size limit as it arrives, so an oversized upload is refused
+    mid-request instead of after it has been spooled to disk in full. save_uploaded_file then links the
+    spooled file into place rather than copying it.
+
+    :param directory: Path - Where to spool; ideally on the same file system as the upload destinations.
+    :param max_bytes: int - Optional size limit for the part.
+    :param progress: callable - Optional callback receiving the number of bytes received so far.
+    """
+    def __init__(self, directory=None, max_bytes: int = None, progress=None):
+        self.file = tempfile.NamedTemporaryFile(dir=directory, prefix=".upload-")
+        self.max_bytes = max_bytes
+        self.progress = progress
+        self.digest = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+        if self.max_bytes is not None and self.size > self.max_bytes:
+            raise UploadTooLarge(f"An uploaded file exceeds the limit of {self.max_bytes} bytes")
+        self.digest.update(data)
+        written = self.file.write(data)
+        if self.progress:
+            self.progress(self.size)
+        return written
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+def save_uploaded_file(uploaded_file, destination: Path, max_bytes: int = None, chunk_size: int = 1024 * 1024, progress=None):
+    """
+    Stream an uploaded file to disk in fixed-size chunks, hashing it on the way.
+
+    Memory use stays at one chunk regardless of the file size. Files spooled into an UploadSpool were
+    already hashed and size checked during parsing and are linked into place instead.
+
+    :param uploaded_file: The uploaded file (a werkzeug FileStorage or any object with a read method).
+    :param destination: Path - Where to save the file.
+    :param max_bytes: int - Optional size limit; the upload is rejected as soon as it is exceeded.
+    :param chunk_size: int - Number of bytes copied at a time.
+    :param progress: callable - Optional callback receiving the number of bytes received so far; spooled
+                                files reported their progress while they arrived.
+    :return: tuple - (destination, SHA-256 hex digest of the contents).
+    """
+    declared_size = getattr(uploaded_file, 'content_length', None)
+    if max_bytes is not None and declared_size and declared_size > max_bytes:
+        raise UploadTooLarge(f"{destination.name} is {declared_size} bytes, the limit is {max_bytes} bytes")
+
+    stream = getattr(uploaded_file, 'stream', uploaded_file)
+    if isinstance(stream, UploadSpool):
+        # Already received, size checked and hashed while the request was parsed
+        if max_bytes is not None and stream.size > max_bytes:
+            raise UploadTooLarge(f"{destination.name} is {stream.size} bytes, the limit is {max_bytes} bytes")
+        stream.flush()
+        link_or_copy(stream.name, destination)
+        remember_file_digest(destination, stream.digest.hexdigest())
+        return destination, stream.digest.hexdigest()
+
+    digest = hashlib.sha256()
+    received = 0
+    try:
+        with destination.open('wb') as f:
+            for chunk in iter(lambda: stream.read(chunk_size), b''):
+                received += len(chunk)
+                if max_bytes is not None and received > max_bytes:
+                    raise UploadTooLarge(f"{destination.name} exceeds the limit of {max_bytes} bytes")
+                digest.update(chunk)
+                f.write(chunk)
+                if progress:
+                    progress(received)
+    except UploadTooLarge:
+        destination.unlink(missing_ok=True)
+        raise
+
+    remember_file_digest(destination, digest.hexdigest())
+    return destination, digest.hexdigest()
+
+def file_digest(path, chunk_size: int = 1024 * 1024) -> str:
+    """
+    SHA-256 of a file's contents, memoized on path, size and modification time.
+    """
+    key = _digest_key(path)
+    with _digests_lock:
+        if key in _digests:
+            return _digests[key]
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    with _digests_lock:
+        if len(_digests) >= 1024:
+            _digests.clear()
+        _digests[key] = digest.hexdigest()
+    return _digests[key]
+
+def link_or_copy(source, destination):
+    """
+    Hard link a file into another directory, copying it where the two are on different file systems.
+
+    :return: Path - The destination.
+    """
+    destination = Path(destination)
+    destination.unlink(missing_ok=True)
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+    return destination
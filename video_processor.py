@@ -1,13 +1,46 @@
 import os
-import re
+import shutil
 import logging
 import subprocess
-import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from time import sleep
+import numpy as np
+from utils import file_digest
+from metrics import run_process, propagate, stage
+from subtitle_renderer import SubtitleRenderer
+from subtitle_client import SubtitleClient
+from media_probe import ProbeError, probe_media, probe_video_packets, first_stream
+from timeline import Timeline
+from encoding import get_encoding_profile, require_filters
+
+SUBTITLE_SERVICE_URL = "https://video-processing-addsubs.chickenkiller.com/add_subtitles"
+
+class ClipRenderError(Exception):
+    """
+    Raised when one or more clips fail to render.
+
+    :param failures: list of tuples - (clip index, output clip path, error) for every failed clip.
+    :param total: int - Number of clips that were attempted.
+    """
+    def __init__(self, failures, total):
+        self.failures = failures
+        self.total = total
+        details = "; ".join(f"clip {index} ({Path(path).name}): {error}" for index, path, error in failures)
+        super().__init__(f"Failed to render {len(failures)} of {total} clips: {details}")
+
 
 class VideoProcessor:
-    def __init__(self, new_mp3_path, srt_path_new, srt_path_old, video_path, bgm_happy_path, bgm_sad_path, happy_start, happy_end, sad_start, sad_end, bg_width, bg_height, font_size, bottom_padding, max_width, output_dir):
+    # "clips" renders one file per fragment and concatenates them, "filtergraph" decodes and encodes the source once
+    RENDER_ENGINES = ("clips", "filtergraph")
+    SLOW_DOWN_THRESHOLD = 0.8  # Fragments that need more extra time than this (in seconds) are slowed down
+    # "remote" sends the rendered video to the subtitle service, "local" draws the subtitles while rendering it
+    SUBTITLE_MODES = ("remote", "local")
+    # Codecs the rendered video is made of; segments of a source in these codecs can be copied instead of encoded
+    COPYABLE_CODECS = {"video": "h264", "audio": "aac"}
+    # MPEG-TS clips carry their codec parameters in band, so copied and encoded clips can be joined
+    COPY_CLIP_SUFFIX = ".ts"
+
+    def __init__(self, new_mp3_path, srt_path_new, srt_path_old, video_path, bgm_happy_path, bgm_sad_path, happy_start, happy_end, sad_start, sad_end, bg_width, bg_height, font_size, bottom_padding, max_width, output_dir, max_workers=None, threads_per_clip=2, render_engine="clips", music_cache=None, subtitle_service_url=SUBTITLE_SERVICE_URL, subtitle_mode="remote", font_path=None, subtitle_client=None, stream_copy=True, encoding_profile=None, proxy_height=None, clip_cache=None):
         self.new_mp3_path = Path(new_mp3_path)
         self.srt_path_new = Path(srt_path_new)
         self.srt_path_old = Path(srt_path_old)
@@ -25,7 +58,30 @@ class VideoProcessor:
         self.max_width = max_width  # New max width attribute
         self.volume_1 = 1.0  # Volume adjustment for happy music
         self.volume_2 = 0.2  # Volume adjustment for sad music
+        self.music_cache = music_cache  # Optional MediaCache for prepared music beds
+        self.clip_cache = clip_cache  # Optional MediaCache for encoded clips
+        self.subtitle_service_url = subtitle_service_url
+        self.subtitle_client = subtitle_client  # Optional shared SubtitleClient, to reuse its connections
+        if subtitle_mode not in self.SUBTITLE_MODES:
+            raise ValueError(f"Unknown subtitle mode: {subtitle_mode}. Expected one of {', '.join(self.SUBTITLE_MODES)}")
+        self.subtitle_mode = subtitle_mode
+        self.font_path = font_path
         self.output_dir = Path(output_dir)
+        if render_engine not in self.RENDER_ENGINES:
+            raise ValueError(f"Unknown render engine: {render_engine}. Expected one of {', '.join(self.RENDER_ENGINES)}")
+        self.render_engine = render_engine
+        self.threads_per_clip = max(1, int(threads_per_clip))  # ffmpeg threads per clip encode
+        self.stream_copy = stream_copy  # Copy fragments that start and end on keyframes instead of encoding them
+        self.encoding_profile = encoding_profile or get_encoding_profile(None)  # Encoder settings for every encode
+        # Preview mode: render a proxy scaled down to this height. Copied clips would keep the source size,
+        # so every clip is encoded.
+        self.proxy_height = proxy_height
+        if proxy_height:
+            self.stream_copy = False
+        self._source = None
+        self._proxy_scale = None
+        # Size the clip pool so that workers * threads roughly matches the available cores
+        self.max_workers = max(1, int(max_workers or (os.cpu_count() or 1) // self.threads_per_clip))
         os.makedirs(self.output_dir, exist_ok=True)
 
     def run_ffmpeg_command(self, command):
@@ -36,264 +92,567 @@ class VideoProcessor:
         """
         command = [str(arg) for arg in command]  # Convert all arguments to strings
         print(f"Running ffmpeg command: {' '.join(command)}")
-        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        result = run_process(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         if result.returncode != 0:
             print(f"ffmpeg command failed with error: {result.stderr.decode('utf-8')}")
             raise subprocess.CalledProcessError(result.returncode, command)
         else:
             print(result.stdout.decode('utf-8'))
 
-    def adjust_volume(self, input_path, output_path, volume):
+    def music_bed_filter(self, happy_input, sad_input, output_label):
         """
-        Adjust the volume of an audio file.
+        Build the filter chain that turns the two background music files into a single music bed.
 
-        :param input_path: str - Path to the input audio file.
-        :param output_path: str - Path to the output audio file.
-        :param volume: float - Volume adjustment factor (e.g., 0.5 for half volume, 2.0 for double volume).
-        """
-        self.run_ffmpeg_command([
-            "ffmpeg", "-y",
-            "-i", str(input_path),
-            "-filter:a", f"volume={volume}",
-            str(output_path)
-        ])
+        Each track is trimmed to its window, gain adjusted, looped to cover the window length, and the
+        two tracks are then crossfaded together.
 
-    def overlay_audio(self, concatenated_video_path, final_output_path):
+        :param happy_input: int - ffmpeg input index of the happy music file.
+        :param sad_input: int - ffmpeg input index of the sad music file.
+        :param output_label: str - Label of the resulting music bed pad.
+        :return: str - The filter chain.
         """
-        Overlay the audio with background music on the video.
+        tracks = [
+            (happy_input, self.happy_start, self.happy_end, self.volume_1, "m1"),
+            (sad_input, self.sad_start, self.sad_end, self.volume_2, "m2"),
+        ]
+        filters = []
+        for input_index, start, end, volume, label in tracks:
+            filters.append(
+                f"[{input_index}:a]atrim=start={start}:end={end},asetpts=PTS-STARTPTS,"
+                f"volume={volume},"
+                f"aloop=loop=-1:size=2e+09,atrim=0:{end - start}[{label}]"
+            )
+        filters.append(f"[m1][m2]acrossfade=d=0.1[{output_label}]")
+        return ";".join(filters)
+
+    def prepare_music_bed(self):
+        """
+        Render the music bed to a file, reusing a cached copy when the same bed was prepared before.
 
-        :param concatenated_video_path: Path - Path to the concatenated video.
-        :param final_output_path: Path - Path to the final output video.
+        Beds are keyed by the content of both music files, their trim windows (which also set the
+        looped length) and their volumes. Without a music cache the bed is always rendered.
+
+        :return: Path - Path to the prepared music bed.
         """
-        # Trim the first background music file
-        trimmed_music_1 = self.output_dir / "trimmed_music_1.wav"
-        self.run_ffmpeg_command([
-            "ffmpeg", "-y",
-            "-i", str(self.bgm_happy_path),
-            "-ss", str(self.happy_start),
-            "-to", str(self.happy_end),
-            "-c:a", "pcm_s16le",
-            str(trimmed_music_1)
-        ])
+        music_bed_path = self.output_dir / "music_bed.flac"
+        key = None
+        if self.music_cache is not None:
+            key = self.music_cache.make_key(
+                "music-bed",
+                file_digest(self.bgm_happy_path), self.happy_start, self.happy_end, self.volume_1,
+                file_digest(self.bgm_sad_path), self.sad_start, self.sad_end, self.volume_2,
+            )
+            if self.music_cache.fetch(key, music_bed_path):
+                return music_bed_path
 
-        # Trim the second background music file
-        trimmed_music_2 = self.output_dir / "trimmed_music_2.wav"
         self.run_ffmpeg_command([
             "ffmpeg", "-y",
+            "-i", str(self.bgm_happy_path),
             "-i", str(self.bgm_sad_path),
-            "-ss", str(self.sad_start),
-            "-to", str(self.sad_end),
-            "-c:a", "pcm_s16le",
-            str(trimmed_music_2)
+            "-filter_complex", self.music_bed_filter(0, 1, "bgm"),
+            "-map", "[bgm]",
+            "-c:a", "flac",
+            str(music_bed_path)
         ])
+        if key is not None:
+            self.music_cache.store(key, music_bed_path)
+        return music_bed_path
 
-        # Adjust volume of the first trimmed music file
-        adjusted_volume_music_1 = self.output_dir / "adjusted_volume_music_1.wav"
-        self.adjust_volume(trimmed_music_1, adjusted_volume_music_1, self.volume_1)
-
-        # Adjust volume of the second trimmed music file
-        adjusted_volume_music_2 = self.output_dir / "adjusted_volume_music_2.wav"
-        self.adjust_volume(trimmed_music_2, adjusted_volume_music_2, self.volume_2)
+    def overlay_audio(self, concatenated_video_path, final_output_path, music_bed_path=None):
+        """
+        Overlay the audio with background music on the video.
 
-        # Loop the happy and sad music to cover the specified time ranges
-        looped_music_1 = self.output_dir / "looped_music_1.wav"
-        looped_music_2 = self.output_dir / "looped_music_2.wav"
+        Without a music cache, the music bed is prepared and mixed with the new audio in a single ffmpeg
+        invocation, so no intermediate audio files are written. With a cache, the prepared bed is reused
+        across requests.
 
-        self.run_ffmpeg_command([
-            "ffmpeg", "-y",
-            "-i", str(adjusted_volume_music_1),
-            "-filter_complex", f"aloop=loop=-1:size=2e+09,atrim=0:{self.happy_end - self.happy_start}[a]",
-            "-map", "[a]",
-            "-c:a", "pcm_s16le",
-            str(looped_music_1)
-        ])
-
-        self.run_ffmpeg_command([
-            "ffmpeg", "-y",
-            "-i", str(adjusted_volume_music_2),
-            "-filter_complex", f"aloop=loop=-1:size=2e+09,atrim=0:{self.sad_end - self.sad_start}[a]",
-            "-map", "[a]",
-            "-c:a", "pcm_s16le",
-            str(looped_music_2)
-        ])
-
-        # Concatenate the looped music files
-        concatenated_music = self.output_dir / "concatenated_music.wav"
-        self.run_ffmpeg_command([
-            "ffmpeg", "-y",
-            "-i", str(looped_music_1),
-            "-i", str(looped_music_2),
-            "-filter_complex", "[0:a][1:a]acrossfade=d=0.1[a]",
-            "-map", "[a]",
-            "-c:a", "pcm_s16le",
-            str(concatenated_music)
-        ])
+        :param concatenated_video_path: Path - Path to the concatenated video.
+        :param final_output_path: Path - Path to the final output video.
+        :param music_bed_path: Path - Optional music bed already made by prepare_music_bed.
+        """
+        if music_bed_path is not None or self.music_cache is not None:
+            music_inputs = ["-i", str(music_bed_path or self.prepare_music_bed())]
+            music_bed = "[2:a]"
+        else:
+            music_inputs = ["-i", str(self.bgm_happy_path), "-i", str(self.bgm_sad_path)]
+            music_bed = f"{self.music_bed_filter(2, 3, 'bgm')};[bgm]"
+        filtergraph = f"{music_bed}volume=1[a2];[1:a]volume=3.5[a1];[a1][a2]amix=inputs=2:duration=first:dropout_transition=2[a]"
 
-        # Combine the looped music with the original video
+        # Combine the new audio and the music bed with the original video
         self.run_ffmpeg_command([
             "ffmpeg", "-y",
             "-i", str(concatenated_video_path),
             "-i", str(self.new_mp3_path),
-            "-i", str(concatenated_music),
-            "-filter_complex", "[2:a]volume=1[a2];[1:a]volume=3.5[a1];[a1][a2]amix=inputs=2:duration=first:dropout_transition=2[a]",
+            *music_inputs,
+            "-filter_complex", filtergraph,
             "-map", "0:v",
             "-map", "[a]",
             "-c:v", "copy",
-            "-c:a", "aac",
+            *self.encoding_profile.audio_options(),
             str(final_output_path)
         ])
 
-    def parse_srt(self, srt_path):
-        """
-        Parse an SRT file to extract timestamps and text.
-
-        :param srt_path: str - Path to the SRT file.
-        :return: list of tuples - List of (start_time, end_time, text) tuples.
-        """
-        subtitles = []  # Initialize the subtitles list
-        pattern = re.compile(r'(\d{2}:\d{2}:\d{2},\d{3}) --> (\d{2}:\d{2}:\d{2},\d{3})')
-        with open(srt_path, 'r', encoding='utf-8') as file:
-            lines = file.readlines()
-            text = ""
-            for line in lines:
-                line = line.strip()
-                matches = pattern.findall(line)
-                if matches:
-                    if text:
-                        subtitles[-1] = (*subtitles[-1], text)
-                    start_time = matches[0][0]
-                    end_time = matches[0][1]
-                    subtitles.append((start_time, end_time))
-                    text = ""
-                elif line and not line.isdigit():
-                    text += " " + line if text else line
-            if text:
-                subtitles[-1] = (*subtitles[-1], text)
-            else:
-                # Add an empty string for text if none was found
-                if len(subtitles[-1]) == 2:
-                    subtitles[-1] = (*subtitles[-1], "")
-        
-        # Ensure all entries have three elements
-        for i in range(len(subtitles)):
-            if len(subtitles[i]) < 3:
-                subtitles[i] = (*subtitles[i], "")
-        
-        return subtitles
+    def generate_length_for_audios(self):
+        """
+        Load the new and old timelines, from the alignment JSON next to each SRT when available.
 
-    @staticmethod
-    def srt_time_to_seconds(srt_time):
+        :return: tuple of Timeline - The new and old timelines.
         """
-        Convert SRT time format to seconds.
+        return Timeline.load(self.srt_path_new), Timeline.load(self.srt_path_old)
 
-        :param srt_time: str - Time string in SRT format (H:M:S,mmm).
-        :return: float - Time in seconds.
+    def compare_timestamps(self, old_timeline, new_timeline, tolerance=1e-6):
+        """
+        :return: numpy.ndarray - Extra duration the new audio needs per fragment; negligible differences are zero.
         """
-        parts = srt_time.split(":")
-        h = int(parts[0])
-        m = int(parts[1])
-        s_ms = parts[2].split(",")
-        s = int(s_ms[0])
-        ms = int(s_ms[1])
+        return old_timeline.diffs(new_timeline, tolerance)
 
-        total_seconds = h * 3600 + m * 60 + s + ms / 1000.0
-        return total_seconds
+    def refine_timestamps(self, old_timeline, time_diffs):
+        """
+        :return: Timeline - The old timeline with fragments shortened where the new audio is shorter.
+        """
+        return old_timeline.refine(time_diffs)
 
-    def generate_length_for_audios(self):
-        new_audio_timestamps = self.parse_srt(self.srt_path_new)
-        old_audio_timestamps = self.parse_srt(self.srt_path_old)
-        return new_audio_timestamps, old_audio_timestamps
-
-    def compare_timestamps(self, old_timestamps, new_timestamps, tolerance=1e-6):
-        if len(old_timestamps) != len(new_timestamps):
-            raise ValueError("The number of old and new timestamps must be the same.")
-        time_diffs = []
-        for (old_start, old_end, _), (new_start, new_end, _) in zip(old_timestamps, new_timestamps):
-            old_duration = self.srt_time_to_seconds(old_end) - self.srt_time_to_seconds(old_start)
-            new_duration = self.srt_time_to_seconds(new_end) - self.srt_time_to_seconds(new_start)
-            time_diff = new_duration - old_duration
-            if abs(time_diff) < tolerance:
-                time_diff = 0  # Consider negligible differences as zero
-            time_diffs.append(time_diff)
-
-        return time_diffs
-
-    def refine_timestamps(self, old_timestamps, time_diffs):
-        refined_timestamps = []
-        for (start, end, text), time_diff in zip(old_timestamps, time_diffs):
-            if time_diff < 0:
-                end_seconds = self.srt_time_to_seconds(end)
-                end_seconds += time_diff
-                end = f"{int(end_seconds // 3600):02}:{int((end_seconds % 3600) // 60):02}:{int(end_seconds % 60):02},{int((end_seconds % 1) * 1000):03}"
-            refined_timestamps.append((start, end, text))
-        return refined_timestamps
-
-    def trim_video_clips(self, timestamps, time_diffs):
-        clips = []
-        for i, ((start, end, _), time_diff) in enumerate(zip(timestamps, time_diffs)):
-            output_clip = self.output_dir / f"clip_{i}.mp4"
-            
-            # Default FFmpeg command for trimming
-            ffmpeg_command = [
-                "ffmpeg", "-y",           # Overwrite output files without asking
-                "-i", str(self.video_path), # Input file
-                "-ss", f"{self.srt_time_to_seconds(start):.4f}",    # Start time in seconds with four decimal places
-                "-to", f"{self.srt_time_to_seconds(end):.4f}",      # End time in seconds with four decimal places
-                "-c:v", "libx264",        # Re-encode video using libx264 codec
-                "-c:a", "aac",            # Re-encode audio using AAC codec
-                str(output_clip)          # Output file
-            ]
+    def speed_factors(self, timeline, time_diffs):
+        """
+        Compute the playback speed of the fragments that have to be stretched to fit the new audio.
+
+        :param timeline: Timeline - The fragments of the source.
+        :param time_diffs: numpy.ndarray - Extra duration the new audio needs per fragment.
+        :return: list - Speed factor below 1.0 per fragment, or None if the fragment keeps its speed.
+        """
+        return [None if np.isnan(factor) else factor for factor in timeline.speed_factors(time_diffs, self.SLOW_DOWN_THRESHOLD).tolist()]
+
+    @staticmethod
+    def atempo_chain(speed_factor):
+        """
+        Build an atempo filter chain for the given speed factor.
 
-            # Adjust the FFmpeg command if time_diff is greater than 0
-            if time_diff > 0.8:
-                # Calculate the original duration
-                original_duration = self.srt_time_to_seconds(end) - self.srt_time_to_seconds(start)
-                # Calculate the new duration and speed factor
-                new_duration = original_duration + time_diff
-                speed_factor = original_duration / new_duration
-
-                # Update the FFmpeg command to slow down the clip
-                ffmpeg_command = [
-                    "ffmpeg", "-y",           # Overwrite output files without asking
-                    "-i", str(self.video_path), # Input file
-                    "-ss", f"{self.srt_time_to_seconds(start):.4f}",    # Start time in seconds with four decimal places
-                    "-to", f"{self.srt_time_to_seconds(end):.4f}",      # End time in seconds with four decimal places
-                    "-filter_complex", 
-                    f"[0:v]setpts={1/speed_factor}*PTS[v];[0:a]atempo={speed_factor}[a]",
-                    "-map", "[v]",
-                    "-map", "[a]",
-                    "-c:v", "libx264",        # Re-encode video using libx264 codec
-                    "-c:a", "aac",            # Re-encode audio using AAC codec
-                    str(output_clip)          # Output file
-                ]
+        A single atempo instance only accepts factors between 0.5 and 2.0, so larger changes are split into stages.
 
+        :param speed_factor: float - Playback speed factor.
+        :return: str - Comma separated atempo filters.
+        """
+        filters = []
+        while speed_factor < 0.5:
+            filters.append("atempo=0.5")
+            speed_factor /= 0.5
+        while speed_factor > 2.0:
+            filters.append("atempo=2.0")
+            speed_factor /= 2.0
+        filters.append(f"atempo={speed_factor}")
+        return ",".join(filters)
+
+    def source_info(self):
+        """
+        Probe the source video once: its stream parameters and the keyframes it can be cut at without encoding.
+
+        :return: dict - {"media": probe_media result, "frames": numpy.ndarray of frame times, "cut_points":
+                        list of keyframe times}, or None if the source cannot be stream copied.
+        """
+        if self._source is None:
+            self._source = {}
             try:
-                subprocess.run(ffmpeg_command, check=True)  # Run the ffmpeg command
-                if os.path.exists(output_clip):             # Check if the output file was created
-                    clips.append(output_clip)
+                media = probe_media(self.video_path)
+                video, audio = first_stream(media, "video"), first_stream(media, "audio")
+                if not video or video.get("codec_name") != self.COPYABLE_CODECS["video"] or \
+                        (audio and audio.get("codec_name") != self.COPYABLE_CODECS["audio"]):
+                    logging.debug(f"Source codecs cannot be copied, encoding every clip: {self.video_path}")
                 else:
-                    logging.error(f"Failed to create clip: {output_clip}")
-            except subprocess.CalledProcessError as e:
-                logging.error(f"ffmpeg command failed: {e}")
-        
+                    frames, keyframes = probe_video_packets(self.video_path)
+                    # The end of the source is a clean cut point as well
+                    cut_points = keyframes + ([media["duration"]] if media["duration"] else [])
+                    self._source = {"media": media, "frames": np.asarray(frames), "cut_points": cut_points}
+            except (ProbeError, OSError) as e:
+                logging.warning(f"Could not probe the source video, encoding every clip: {e}")
+        return self._source or None
+
+    def proxy_scale(self):
+        """
+        :return: float - Factor the proxy is scaled down by from the source; 1.0 outside preview mode, or if
+                         the source is no taller than the proxy.
+        """
+        if self._proxy_scale is None:
+            self._proxy_scale = 1.0
+            if self.proxy_height:
+                try:
+                    video = first_stream(probe_media(self.video_path), "video")
+                    if video and video.get("height") and int(video["height"]) > self.proxy_height:
+                        self._proxy_scale = self.proxy_height / int(video["height"])
+                except (ProbeError, OSError) as e:
+                    logging.warning(f"Could not probe the source video, rendering the preview at full size: {e}")
+        return self._proxy_scale
+
+    def proxy_filter(self):
+        """
+        :return: str or None - The filter that scales the video down to the proxy, None if it keeps its size.
+        """
+        return f"scale=-2:{self.proxy_height}" if self.proxy_scale() < 1 else None
+
+    def subtitle_style(self):
+        """
+        The subtitle font size and box geometry, scaled with the proxy so a preview looks like the final render.
+
+        :return: dict - font_size, bg_width, bg_height, bottom_padding and max_width in pixels of the rendered video.
+        """
+        scale = self.proxy_scale()
+        style = {name: int(round(getattr(self, name) * scale)) for name in ("font_size", "bg_width", "bg_height", "bottom_padding", "max_width")}
+        style["font_size"] = max(1, style["font_size"])
+        return style
+
+    def frame_tolerance(self, source):
+        """
+        :return: float - Half a frame of the source, the distance within which a cut point counts as on a keyframe.
+        """
+        video = first_stream(source["media"], "video")
+        numerator, _, denominator = video.get("r_frame_rate", "0/0").partition("/")
+        frame_rate = float(numerator) / float(denominator) if float(denominator or 0) else 0
+        return 0.5 / frame_rate if frame_rate else 0.001
+
+    def plan_segments(self, timeline, time_diffs):
+        """
+        Split the fragments into segments that are stream copied or encoded.
+
+        Retimed fragments are encoded whole. Of a fragment that keeps its speed, the whole groups of pictures
+        inside it (from its first to its last keyframe) are copied, and only the partial groups before and
+        after them are encoded. Fragment boundaries come from the alignment and seldom fall on keyframes, so
+        requiring both ends on keyframes would leave almost nothing to copy.
+
+        :param timeline: Timeline - The refined fragments of the source.
+        :param time_diffs: numpy.ndarray - Extra duration needed per fragment.
+        :return: list of tuples - (start seconds, end seconds, speed factor or None, copy) per segment, in order.
+        """
+        speed_factors = self.speed_factors(timeline, time_diffs)
+        source = self.source_info() if self.stream_copy else None
+        cut_points = np.asarray(source["cut_points"]) if source else np.empty(0)
+        tolerance = self.frame_tolerance(source) if source else 0
+
+        segments = []
+        for start_seconds, end_seconds, speed_factor in zip(timeline.starts.tolist(), timeline.ends.tolist(), speed_factors):
+            if speed_factor is None and len(cut_points):
+                # First and last cut points inside the fragment, allowing half a frame on either side
+                first = np.searchsorted(cut_points, start_seconds - tolerance)
+                last = np.searchsorted(cut_points, end_seconds + tolerance, side="right") - 1
+                if first < last:
+                    copy_start, copy_end = float(cut_points[first]), float(cut_points[last])
+                    if copy_start - start_seconds > tolerance:
+                        segments.append((start_seconds, copy_start, None, False))
+                    segments.append((copy_start, copy_end, None, True))
+                    if end_seconds - copy_end > tolerance:
+                        segments.append((copy_end, end_seconds, None, False))
+                    continue
+            segments.append((start_seconds, end_seconds, speed_factor, False))
+        return segments
+
+    def build_trim_command(self, start_seconds, end_seconds, speed_factor, output_clip, copy=False, match_source=False):
+        """
+        Build the ffmpeg command that cuts (and optionally slows down) one clip.
+
+        The source is seeked on input, so the clip duration applies to the source and a slowed down clip
+        keeps its full stretched length.
+
+        :param start_seconds: float - Start of the fragment in seconds.
+        :param end_seconds: float - End of the fragment in seconds.
+        :param speed_factor: float or None - Playback speed of the clip, None to keep the speed.
+        :param output_clip: Path - Path to the output clip.
+        :param copy: bool - Copy the streams instead of encoding them; the cut points must be keyframes.
+        :param match_source: bool - Encode with the source's pixel format and audio layout, so the clip can be
+                                    joined with copied clips.
+        :return: list - The ffmpeg command.
+        """
+        # Keep each encode from claiming every core: the decoder, the filter graph and the encoder all size
+        # their thread pools separately. Stream copies neither decode nor filter.
+        threads = str(self.threads_per_clip)
+        filter_options = [] if copy else ["-filter_threads", threads, "-filter_complex_threads", threads]
+        decoder_options = [] if copy else ["-threads", threads]
+        ffmpeg_command = [
+            "ffmpeg", "-y",           # Overwrite output files without asking
+            *filter_options,
+            "-ss", f"{start_seconds:.4f}",    # Start time in seconds with four decimal places
+            "-t", f"{end_seconds - start_seconds:.4f}",  # Duration of the fragment in the source
+            *decoder_options,
+            "-i", str(self.video_path), # Input file
+        ]
+
+        if copy:
+            # Stream copy stops on decode order, so with B-frames the next keyframe would slip in; stop after
+            # the fragment's frames instead. The GOPs are whole, so they are exactly the first packets.
+            source = self.source_info()
+            tolerance = self.frame_tolerance(source)
+            frames = source["frames"]
+            frame_count = int(((frames >= start_seconds - tolerance) & (frames < end_seconds - tolerance)).sum())
+            return ffmpeg_command + ["-frames:v", str(frame_count), "-shortest", "-c", "copy", "-avoid_negative_ts", "make_zero", str(output_clip)]
+
+        # Slow down the clip if the new audio needs noticeably more time
+        proxy_filter = self.proxy_filter()
+        if speed_factor:
+            video_chain = f"setpts={1/speed_factor}*PTS" + (f",{proxy_filter}" if proxy_filter else "")
+            ffmpeg_command += [
+                "-filter_complex",
+                f"[0:v]{video_chain}[v];[0:a]{self.atempo_chain(speed_factor)}[a]",
+                "-map", "[v]",
+                "-map", "[a]",
+            ]
+        elif proxy_filter:
+            ffmpeg_command += ["-vf", proxy_filter]
+
+        ffmpeg_command += [
+            *self.encoding_profile.video_options(),  # Re-encode video as H.264 with the profile's settings
+            *self.encoding_profile.audio_options(),  # Re-encode audio as AAC
+        ]
+
+        # Encoded clips that are joined with copied ones have to match the source's stream parameters
+        source = self.source_info() if match_source else None
+        if source:
+            video, audio = first_stream(source["media"], "video"), first_stream(source["media"], "audio")
+            if video.get("pix_fmt"):
+                ffmpeg_command += ["-pix_fmt", video["pix_fmt"]]
+            if audio and audio.get("sample_rate"):
+                ffmpeg_command += ["-ar", str(audio["sample_rate"]), "-ac", str(audio["channels"])]
+
+        ffmpeg_command += [
+            "-threads", threads,      # Encoder threads
+            str(output_clip)          # Output file
+        ]
+        return ffmpeg_command
+
+    def render_clip(self, ffmpeg_command, output_clip):
+        """
+        Run one clip encode and verify that the clip was written.
+
+        :param ffmpeg_command: list - The ffmpeg command to run.
+        :param output_clip: Path - Path to the output clip.
+        :return: Path - Path to the rendered clip.
+        """
+        result = run_process(ffmpeg_command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if result.returncode != 0:
+            raise subprocess.CalledProcessError(result.returncode, ffmpeg_command, output=result.stdout, stderr=result.stderr)
+        if not os.path.exists(output_clip):  # Check if the output file was created
+            raise FileNotFoundError(f"Failed to create clip: {output_clip}")
+        return output_clip
+
+    @staticmethod
+    def describe_clip_error(error):
+        """
+        Reduce a clip render error to a short, loggable message.
+
+        :param error: Exception - The error raised while rendering a clip.
+        :return: str - The error message, including the last ffmpeg stderr line if available.
+        """
+        if isinstance(error, subprocess.CalledProcessError) and error.stderr:
+            lines = error.stderr.decode('utf-8', errors='replace').strip().splitlines()
+            if lines:
+                return f"ffmpeg exited with status {error.returncode}: {lines[-1]}"
+        return str(error)
+
+    def clip_cache_key(self, start_seconds, end_seconds, speed_factor, suffix):
+        """
+        Cache key of an encoded clip: the source's content, the fragment's times as they are passed to
+        ffmpeg, its speed and everything that decides how it is encoded.
+
+        :return: str - The key, or None without a clip cache.
+        """
+        if self.clip_cache is None:
+            return None
+        return self.clip_cache.make_key(
+            "clip", file_digest(self.video_path), f"{start_seconds:.4f}", f"{end_seconds:.4f}",
+            f"{speed_factor:.6f}" if speed_factor else None,
+            self.encoding_profile.name, self.encoding_profile.video_encoder(), self.proxy_height, suffix,
+        )
+
+    def trim_video_clips(self, timeline, time_diffs, plan=None):
+        """
+        Cut the video into the segments of `plan_segments`, running up to `max_workers` encodes at once.
+
+        With a clip cache, encoded clips are reused across jobs: after a script edit, only the fragments
+        whose timing changed are encoded again. Stream copied clips are cheap to cut and are not cached.
+
+        :param timeline: Timeline - The refined fragments of the source.
+        :param time_diffs: numpy.ndarray - Extra duration needed per fragment.
+        :param plan: list - Optional result of `plan_segments`, if it was already made.
+        :return: list of Path - Rendered clips, in timestamp order.
+        """
+        plan = self.plan_segments(timeline, time_diffs) if plan is None else plan
+        if not plan:
+            return []
+
+        # Only a plan that copies segments needs clips that can be joined with copied ones
+        copies = any(copy for *_, copy in plan)
+        suffix = self.COPY_CLIP_SUFFIX if copies else ".mp4"
+        clips = [None] * len(plan)
+        jobs = []
+        for i, (start_seconds, end_seconds, speed_factor, copy) in enumerate(plan):
+            output_clip = self.output_dir / f"clip_{i}{suffix}"
+            key = None if copy else self.clip_cache_key(start_seconds, end_seconds, speed_factor, suffix)
+            if key and self.clip_cache.fetch(key, output_clip):
+                clips[i] = output_clip
+                continue
+            jobs.append((i, output_clip, self.build_trim_command(start_seconds, end_seconds, speed_factor, output_clip, copy, match_source=copies), key))
+        copied = sum(copy for *_, copy in plan)
+        logging.debug(f"Stream copying {copied} of {len(plan)} segments, reusing {len(plan) - len(jobs)} cached clips")
+
+        if not jobs:
+            return clips
+
+        failures = []
+        workers = min(self.max_workers, len(jobs))
+        logging.debug(f"Rendering {len(jobs)} clips with {workers} workers, {self.threads_per_clip} threads each")
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(propagate(self.render_clip), ffmpeg_command, output_clip): (i, output_clip, key)
+                for i, output_clip, ffmpeg_command, key in jobs
+            }
+            for future in as_completed(futures):
+                i, output_clip, key = futures[future]
+                try:
+                    clips[i] = future.result()
+                except (subprocess.CalledProcessError, OSError) as e:
+                    message = self.describe_clip_error(e)
+                    logging.error(f"Failed to create clip {output_clip}: {message}")
+                    failures.append((i, output_clip, message))
+                    continue
+                if key:
+                    self.clip_cache.store(key, output_clip)
+
+        if failures:
+            raise ClipRenderError(sorted(failures), len(jobs))
+
         return clips
 
-    def concatenate_clips(self, clips, output_path):
+    def concatenate_clips(self, clips, output_path, video_filter=None, durations=None):
+        """
+        Join the clips into one video. The streams are copied, unless a video filter (e.g. subtitles) has
+        to be applied, in which case the video is re-encoded in the same pass.
+
+        :param clips: list of Path - The clips, in order.
+        :param output_path: Path - Path to the joined video.
+        :param video_filter: str - Optional filter chain for the joined video stream.
+        :param durations: list of float - Optional intended length of every clip. Each clip then starts where
+                                          the previous one should end, rather than after its encoded audio,
+                                          which is padded to whole AAC frames and would add up over many clips.
+        """
         with open(self.output_dir / "filelist.txt", "w") as file:
-            for clip in clips:
+            for i, clip in enumerate(clips):
                 file.write(f"file '{os.path.abspath(clip)}'\n")
+                if durations:
+                    file.write(f"duration {durations[i]:.6f}\n")
         ffmpeg_command = [
             "ffmpeg", "-y",
             "-f", "concat",
             "-safe", "0",
             "-i", str(self.output_dir / "filelist.txt"),
-            "-c", "copy",
-            str(output_path)
         ]
-        subprocess.run(ffmpeg_command, check=True)
-        os.remove(self.output_dir / "filelist.txt")
+        filtergraph_path = self.output_dir / "concat_filter.txt"
+        if video_filter:
+            with open(filtergraph_path, "w") as file:
+                file.write(f"[0:v]{video_filter}[v]")
+            ffmpeg_command += [
+                "-filter_complex_script", str(filtergraph_path),
+                "-map", "[v]",
+                "-map", "0:a",
+                *self.encoding_profile.video_options(),
+                "-c:a", "copy",
+            ]
+        else:
+            ffmpeg_command += ["-c", "copy"]
+        ffmpeg_command.append(str(output_path))
+        try:
+            run_process(ffmpeg_command, check=True)
+        finally:
+            os.remove(self.output_dir / "filelist.txt")
+            if video_filter:
+                os.remove(filtergraph_path)
+
+    def build_filtergraph(self, timeline, time_diffs, video_filter=None):
+        """
+        Build a filter_complex that cuts, retimes and joins every fragment of the source in one pass.
 
-    def send_to_subtitle_service(self, video_path, srt_path, subtitle_service_url, font_path, font_size, bg_width, bg_height, bottom_padding, max_width, retries=3, wait=10):
+        :param timeline: Timeline - The refined fragments of the source.
+        :param time_diffs: numpy.ndarray - Extra duration needed per fragment.
+        :param video_filter: str - Optional filter chain applied to the joined video (e.g. subtitles).
+        :return: str - The filtergraph, producing [v] and [a].
+        """
+        filters = []
+        segments = []
+        fragments = zip(timeline.starts.tolist(), timeline.ends.tolist(), self.speed_factors(timeline, time_diffs))
+        for i, (start_seconds, end_seconds, speed_factor) in enumerate(fragments):
+            video = f"[0:v]trim=start={start_seconds:.4f}:end={end_seconds:.4f},setpts=PTS-STARTPTS"
+            audio = f"[0:a]atrim=start={start_seconds:.4f}:end={end_seconds:.4f},asetpts=PTS-STARTPTS"
+            if speed_factor:
+                video += f",setpts={1/speed_factor}*PTS"
+                audio += f",{self.atempo_chain(speed_factor)}"
+            filters.append(f"{video}[v{i}]")
+            filters.append(f"{audio}[a{i}]")
+            segments.append(f"[v{i}][a{i}]")
+        if video_filter:
+            filters.append(f"{''.join(segments)}concat=n={len(segments)}:v=1:a=1[joined][a]")
+            filters.append(f"[joined]{video_filter}[v]")
+        else:
+            filters.append(f"{''.join(segments)}concat=n={len(segments)}:v=1:a=1[v][a]")
+        return ";\n".join(filters)
+
+    def render_filtergraph(self, timeline, time_diffs, output_path, video_filter=None):
+        """
+        Render the whole timeline with a single ffmpeg process: the source is decoded once and encoded once.
+
+        :param timeline: Timeline - The refined fragments of the source.
+        :param time_diffs: numpy.ndarray - Extra duration needed per fragment.
+        :param output_path: Path - Path to the rendered video.
+        :param video_filter: str - Optional filter chain applied to the joined video (e.g. subtitles).
+        """
+        if not len(timeline):
+            raise ValueError("Cannot render an empty timeline.")
+        # The graph grows with the number of fragments, so pass it as a script rather than on the command line
+        filtergraph_path = self.output_dir / "filtergraph.txt"
+        with open(filtergraph_path, "w") as file:
+            file.write(self.build_filtergraph(timeline, time_diffs, video_filter))
+        try:
+            self.run_ffmpeg_command([
+                "ffmpeg", "-y",
+                "-i", str(self.video_path),
+                "-filter_complex_script", str(filtergraph_path),
+                "-map", "[v]",
+                "-map", "[a]",
+                *self.encoding_profile.video_options(),
+                *self.encoding_profile.audio_options(),
+                str(output_path)
+            ])
+        finally:
+            os.remove(filtergraph_path)
+
+    def render_timeline(self, timeline, time_diffs, output_path, video_filter=None):
+        """
+        Render the refined timeline into a single video using the configured render engine.
+
+        :param timeline: Timeline - The refined fragments of the source.
+        :param time_diffs: numpy.ndarray - Extra duration needed per fragment.
+        :param output_path: Path - Path to the rendered video.
+        :param video_filter: str - Optional filter chain applied to the joined video (e.g. subtitles).
+        """
+        logging.debug(f"Rendering timeline with the {self.render_engine} engine and the {self.encoding_profile.name} encoding profile")
+        if self.render_engine == "filtergraph":
+            # The clips engine scales every clip as it is cut; here the joined video is scaled
+            video_filter = ",".join(chain for chain in (self.proxy_filter(), video_filter) if chain) or None
+            self.render_filtergraph(timeline, time_diffs, output_path, video_filter)
+        else:
+            plan = self.plan_segments(timeline, time_diffs)
+            trimmed_clips = self.trim_video_clips(timeline, time_diffs, plan)
+            durations = [(end_seconds - start_seconds) / (speed_factor or 1) for start_seconds, end_seconds, speed_factor, _ in plan]
+            self.concatenate_clips(trimmed_clips, output_path, video_filter, durations)
+
+    def subtitle_filter(self, subtitles, text_dir):
+        """
+        Build the filter chain that burns the subtitles into the rendered video.
+
+        :param subtitles: Timeline - The subtitles, timed like the new audio.
+        :param text_dir: Path - Directory for the subtitle text files.
+        :return: str - The filter chain.
+        """
+        require_filters("drawbox", "drawtext")
+        style = self.subtitle_style()
+        renderer = SubtitleRenderer(self.font_path, style["font_size"], style["bg_width"], style["bg_height"], style["bottom_padding"], style["max_width"])
+        return renderer.build_filter(subtitles.cues(), text_dir)
+
+    def send_to_subtitle_service(self, video_path, srt_path, subtitle_service_url, font_path, font_size, bg_width, bg_height, bottom_padding, max_width):
         """
         Send video and SRT to subtitle service and return the processed video path.
 
@@ -306,58 +665,71 @@ class VideoProcessor:
         :param bg_height: int - Height of the background box.
         :param bottom_padding: int - Padding at the bottom of the background.
         :param max_width: int - Maximum width of the text box before wrapping.
-        :param retries: int - Number of retry attempts.
-        :param wait: int - Wait time between retries in seconds.
         :return: Path - Path to the processed video with subtitles.
         """
-        files = {
-            'video': open(video_path, 'rb'),
-            'srt': open(srt_path, 'rb')
-        }
-        data = {
-            'font_path': font_path,
-            'font_size': font_size,
-            'bg_width': bg_width,
-            'bg_height': bg_height,
-            'bottom_padding': bottom_padding,
-            'max_width': max_width  # Include max width in the request data
-        }
-
-        for attempt in range(retries):
+        client = self.subtitle_client
+        if client is None or client.url != subtitle_service_url:
+            client = SubtitleClient(subtitle_service_url)
+        return client.add_subtitles(
+            video_path, srt_path, self.output_dir / "video_with_subtitles.mp4",
+            font_path=font_path,
+            font_size=font_size,
+            bg_width=bg_width,
+            bg_height=bg_height,
+            bottom_padding=bottom_padding,
+            max_width=max_width  # Include max width in the request data
+        )
+
+    def render_video(self):
+        """
+        Cut and retime the source to the new timestamps. In local subtitle mode, the subtitles are drawn
+        in the same encode.
+
+        :return: Path - Path to the rendered video.
+        """
+        new_timeline, old_timeline = self.generate_length_for_audios()
+        print(f"New timestamps: {new_timeline.srt_entries()}")  # Debugging statement
+        print(f"Old timestamps: {old_timeline.srt_entries()}")  # Debugging statement
+        time_diffs = self.compare_timestamps(old_timeline, new_timeline)
+        refined_timeline = self.refine_timestamps(old_timeline, time_diffs)
+        print(f"Refined timestamps: {refined_timeline.srt_entries()}")  # Debugging statement
+        concatenated_video_path = self.output_dir / "concatenated_video.mp4"
+
+        if self.subtitle_mode == "local":
+            # Draw the subtitles in the encode that renders the timeline
+            text_dir = self.output_dir / "subtitles"
             try:
-                response = requests.post(subtitle_service_url, files=files, data=data, timeout=6000)
-                if response.status_code == 200:
-                    # Save the received video
-                    processed_video_path = self.output_dir / "video_with_subtitles.mp4"
-                    with open(processed_video_path, 'wb') as f:
-                        f.write(response.content)
-                    return processed_video_path
-                else:
-                    logging.error(f"Failed to receive processed video. Status code: {response.status_code}")
-            except requests.exceptions.RequestException as e:
-                logging.error(f"Error contacting subtitle service: {e}")
+                self.render_timeline(refined_timeline, time_diffs, concatenated_video_path,
+                                     self.subtitle_filter(new_timeline, text_dir))
+            finally:
+                shutil.rmtree(text_dir, ignore_errors=True)
+        else:
+            self.render_timeline(refined_timeline, time_diffs, concatenated_video_path)
+        return concatenated_video_path
 
-            logging.info(f"Retrying... ({attempt + 1}/{retries})")
-            sleep(wait)
+    def add_subtitles(self, video_path):
+        """
+        Have the subtitle service burn the subtitles into the rendered video. In local subtitle mode they
+        already are, and the video is returned as is.
 
-        raise Exception("Failed to receive processed video after multiple attempts")
+        :param video_path: Path - The rendered video.
+        :return: Path - Path to the video with subtitles.
+        """
+        if self.subtitle_mode == "local":
+            return video_path
+        # Send the video and new SRT to subtitle service
+        style = self.subtitle_style()
+        return self.send_to_subtitle_service(video_path, self.srt_path_new, self.subtitle_service_url, str(self.output_dir / "Montserrat-Bold.ttf"), style["font_size"], style["bg_width"], style["bg_height"], style["bottom_padding"], style["max_width"])
 
     def process_video(self):
-        new_timestamps, old_timestamps = self.generate_length_for_audios()
-        print(f"New timestamps: {new_timestamps}")  # Debugging statement
-        print(f"Old timestamps: {old_timestamps}")  # Debugging statement
-        time_diffs = self.compare_timestamps(old_timestamps, new_timestamps)
-        refined_timestamps = self.refine_timestamps(old_timestamps, time_diffs)
-        print(f"Refined timestamps: {refined_timestamps}")  # Debugging statement
-        trimmed_clips = self.trim_video_clips(refined_timestamps, time_diffs)
-        concatenated_video_path = self.output_dir / "concatenated_video.mp4"
-        self.concatenate_clips(trimmed_clips, concatenated_video_path)
-        
-        # Send the video and new SRT to subtitle service
-        subtitle_service_url = "https://video-processing-addsubs.chickenkiller.com/add_subtitles"
-        subtitled_video_path = self.send_to_subtitle_service(concatenated_video_path, self.srt_path_new, subtitle_service_url, str(self.output_dir / "Montserrat-Bold.ttf"), self.font_size, self.bg_width, self.bg_height, self.bottom_padding, self.max_width)
+        with stage("render_timeline"):
+            concatenated_video_path = self.render_video()
+
+        with stage("subtitles"):
+            subtitled_video_path = self.add_subtitles(concatenated_video_path)
 
         final_output_path = self.output_dir / "final_video.mp4"
-        self.overlay_audio(subtitled_video_path, final_output_path)
+        with stage("mix_audio"):
+            self.overlay_audio(subtitled_video_path, final_output_path)
 
         return final_output_path
@@ -1,26 +1,85 @@
-import subprocess
 import os
+import logging
+from metrics import run_process
+from media_probe import ProbeError, probe_media, first_stream
+
+class NoAudioTrack(Exception):
+    """
+    Raised when a video has no audio to extract.
+    """
 
 class VideoToAudioConverter:
+    # "pcm16k" decodes to the mono 16 kHz PCM WAV aeneas works on, "copy" keeps the original audio stream
+    # untouched (for archival), "mp3" transcodes to VBR MP3
+    MODES = ("pcm16k", "copy", "mp3")
+    OUTPUT_SUFFIXES = {"pcm16k": ".16k.wav", "copy": ".mka", "mp3": ".mp3"}
+    SAMPLE_RATE = 16000
+
     def __init__(self):
         pass
 
-    def convert_mp4_to_mp3(self, video_path, output_path):
+    def audio_stream(self, video_path):
         """
-        Convert an MP4 video file to an MP3 audio file using ffmpeg.
-        
-        :param video_path: str - Path to the input MP4 file.
-        :param output_path: str - Path to save the output MP3 file.
+        Probe the video for an audio track before spending a decode on it.
+
+        :param video_path: str - Path to the video.
+        :return: dict or None - ffprobe's description of the first audio stream, or None if the container has
+                                none. If the video cannot be probed, an empty dict is returned and extraction
+                                is attempted anyway.
         """
+        try:
+            return first_stream(probe_media(video_path), "audio")
+        except (ProbeError, OSError) as e:
+            logging.warning(f"Could not probe {video_path} for audio: {e}")
+            return {}
+
+    def has_audio(self, video_path):
+        """
+        :return: bool - False if the video is known to have no audio track.
+        """
+        return self.audio_stream(video_path) is not None
+
+    def extract_audio(self, video_path, output_path, mode="pcm16k"):
+        """
+        Extract the audio track of a video file.
+
+        :param video_path: str - Path to the input video file.
+        :param output_path: str - Path to save the audio to; see OUTPUT_SUFFIXES for the extension each mode expects.
+        :param mode: str - One of MODES.
+        :return: str - output_path.
+        """
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown extraction mode: {mode}. Expected one of {', '.join(self.MODES)}")
+        if not self.has_audio(video_path):
+            raise NoAudioTrack(f"The video has no audio track: {video_path}")
+
+        if mode == "pcm16k":
+            codec_options = ["-ac", "1", "-ar", str(self.SAMPLE_RATE), "-c:a", "pcm_s16le"]
+        elif mode == "copy":
+            codec_options = ["-c:a", "copy"]
+        else:
+            codec_options = ["-q:a", "0"]  # Set audio quality to highest
+
         ffmpeg_command = [
             "ffmpeg", "-y",              # Overwrite output files without asking
-            "-i", video_path,            # Input file
-            "-q:a", "0",                 # Set audio quality to highest
-            "-map", "a",                 # Extract audio track
-            output_path                  # Output file
+            "-i", str(video_path),       # Input file
+            "-map", "0:a:0",             # Extract the first audio track
+            "-vn",
+            *codec_options,
+            str(output_path)             # Output file
         ]
-        subprocess.run(ffmpeg_command, check=True)  # Run the ffmpeg command
+        run_process(ffmpeg_command, check=True)  # Run the ffmpeg command
         if os.path.exists(output_path):             # Check if the output file was created
-            print(f"Successfully created MP3 file: {output_path}")
+            print(f"Successfully extracted audio: {output_path}")
         else:
-            raise Exception(f"Failed to create MP3 file: {output_path}")
+            raise Exception(f"Failed to extract audio: {output_path}")
+        return output_path
+
+    def convert_mp4_to_mp3(self, video_path, output_path):
+        """
+        Convert an MP4 video file to an MP3 audio file using ffmpeg.
+
+        :param video_path: str - Path to the input MP4 file.
+        :param output_path: str - Path to save the output MP3 file.
+        """
+        return self.extract_audio(video_path, output_path, mode="mp3")